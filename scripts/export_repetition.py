@@ -0,0 +1,25 @@
+import os
+import sys
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import argparse
+
+from swp.models.export import export_repetition
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--name", type=str)
+    parser.add_argument("--epoch", type=str, help="Epoch or checkpoint, e.g. 30 or 1_5")
+    args = parser.parse_args()
+    print(f"Exporting model: {args.name}")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = export_repetition(args.name, args.epoch)
+    print(f"Saved to {path}")
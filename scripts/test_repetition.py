@@ -7,6 +7,8 @@ sys.path.append(parent)
 
 import argparse
 
+import torch
+
 from swp.datasets.phonemes import Phonemes
 from swp.test.repetition import test_repetition
 from swp.utils.setup import seed_everything, set_device
@@ -15,6 +17,12 @@ from swp.utils.setup import seed_everything, set_device
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument("--name", type=str)
+    parser.add_argument("--beam_size", type=int, default=1)
+    parser.add_argument(
+        "--quantized",
+        action="store_true",
+        help="Score int8 dynamically quantized models, CPU only",
+    )
     args = parser.parse_args()
     print(f"Testing model: {args.name}")
     return args
@@ -25,4 +33,6 @@ if __name__ == "__main__":
     seed_everything()
     P = Phonemes()
     args = parse_args()
-    dfrs = test_repetition(P, args.name, device)
+    if args.quantized:
+        device = torch.device("cpu")
+    dfrs = test_repetition(P, args.name, device, args.beam_size, args.quantized)
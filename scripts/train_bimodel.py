@@ -0,0 +1,93 @@
+import os
+import sys
+
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+import argparse
+from pathlib import Path
+
+from swp.datasets.phonemes import Phonemes
+from swp.train.bimodel import train_bimodel
+from swp.utils.setup import seed_everything, set_device
+
+""" ARGUMENT PARSER """
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--image_root",
+        type=Path,
+        required=True,
+        help="Image folder with one subfolder per word",
+    )
+
+    parser.add_argument(
+        "--cornet_model",
+        type=str,
+        default="S",
+        help="CORnet backbone whose cached features are read",
+    )
+
+    parser.add_argument(
+        "--num_epochs",
+        type=int,
+        default=40,
+    )
+
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Batch size of each modality",
+    )
+
+    parser.add_argument(
+        "--hidden_size",
+        type=int,
+        default=4,
+        help="Hidden size",
+    )
+
+    parser.add_argument(
+        "--num_layers",
+        type=int,
+        default=1,
+        help="Hidden layers",
+    )
+
+    parser.add_argument(
+        "--dropout",
+        type=float,
+        default=0.0,
+        help="Dropout rate",
+    )
+
+    parser.add_argument(
+        "--tf_ratio",
+        type=float,
+        default=0.0,
+        help="Teacher forcing",
+    )
+
+    parser.add_argument(
+        "--learning_rate",
+        type=float,
+        default=0.001,
+        help="Learning rate",
+    )
+
+    args = parser.parse_args()
+    return args
+
+
+if __name__ == "__main__":
+    device = set_device()
+    seed_everything()
+    args = parse_args()
+    params = vars(args)
+    P = Phonemes(batch_size=args.batch_size)
+    model = train_bimodel(P, args.image_root, params, device)
@@ -10,7 +10,8 @@ import argparse
 import torch
 
 from swp.datasets.phonemes import Phonemes
-from swp.train.repetition import train_repetition
+from swp.train.repetition import LOSSES, TF_SCHEDULES, train_repetition
+from swp.utils.datasets import TRAIN_DRAWS
 from swp.utils.setup import seed_everything, set_device
 
 """ ARGUMENT PARSER """
@@ -32,6 +33,13 @@ def parse_args():
         help="Batch size",
     )
 
+    parser.add_argument(
+        "--epoch_size",
+        type=int,
+        default=TRAIN_DRAWS,
+        help="Frequency-weighted training words drawn per epoch",
+    )
+
     parser.add_argument(
         "--hidden_size",
         type=int,
@@ -60,6 +68,37 @@ def parse_args():
         help="Teacher forcing",
     )
 
+    parser.add_argument(
+        "--tf_schedule",
+        type=str,
+        default="constant",
+        choices=TF_SCHEDULES,
+        help="Teacher forcing decay across epochs",
+    )
+
+    parser.add_argument(
+        "--tf_decay",
+        type=float,
+        default=None,
+        help="Exponential decay rate (default 0.9), or k >= 1 of the inverse "
+        "sigmoid schedule (default 10)",
+    )
+
+    parser.add_argument(
+        "--loss",
+        type=str,
+        default="ce",
+        choices=LOSSES,
+        help="Cross entropy, or CTC / soft-DTW on free-running outputs",
+    )
+
+    parser.add_argument(
+        "--sdtw_gamma",
+        type=float,
+        default=0.1,
+        help="Soft-DTW smoothing",
+    )
+
     parser.add_argument(
         "--learning_rate",
         type=float,
@@ -74,7 +113,7 @@ def parse_args():
 if __name__ == "__main__":
     device = set_device()
     seed_everything()
-    P = Phonemes()
     args = parse_args()
     params = vars(args)
+    P = Phonemes(batch_size=args.batch_size, epoch_size=args.epoch_size)
     model = train_repetition(P, params, device)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+from .vocabulary import Vocabulary
+
+# Bump when the on-disk layout changes, stale corpora are then rebuilt
+CORPUS_VERSION = 2
+TOKEN_DTYPE = np.int16
+OFFSET_DTYPE = np.int64
+
+
+def hash_files(paths: Sequence[Path]) -> str:
+    digest = hashlib.sha1()
+    for path in paths:
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def write_corpus(
+    directory: Path,
+    splits: dict[str, list[list[str]]],
+    vocabulary: Vocabulary,
+    source_hash: str,
+) -> None:
+    """
+    Packs each split into a flat token array and an offsets array, so that
+    word `i` is `tokens[offsets[i] : offsets[i + 1]]`. Files are written to a
+    temporary sibling directory and moved into place one by one, the header
+    last. Jobs that already mapped the previous files keep reading them, and
+    an interrupted write never looks like a valid corpus.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(prefix=f".{directory.name}-", dir=directory.parent))
+
+    try:
+        split_sizes = {}
+        for name, words in splits.items():
+            lengths = np.array([len(w) for w in words], dtype=OFFSET_DTYPE)
+            offsets = np.zeros(len(words) + 1, dtype=OFFSET_DTYPE)
+            np.cumsum(lengths, out=offsets[1:])
+
+            tokens = vocabulary.encode_flat([p for w in words for p in w])
+            tokens = tokens.astype(TOKEN_DTYPE)
+            tokens.tofile(staging / f"{name}_tokens.bin")
+            offsets.tofile(staging / f"{name}_offsets.bin")
+            split_sizes[name] = {"words": len(words), "tokens": len(tokens)}
+
+        header = {
+            "version": CORPUS_VERSION,
+            "hash": source_hash,
+            "vocabulary": vocabulary.to_dict(),
+            "splits": split_sizes,
+        }
+        with (staging / "header.json").open("w") as f:
+            json.dump(header, f)
+
+        # Renames swap whole files, mapped files are never truncated
+        (directory / "header.json").unlink(missing_ok=True)
+        for path in sorted(staging.glob("*.bin")):
+            os.replace(path, directory / path.name)
+        os.replace(staging / "header.json", directory / "header.json")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+class PhonemeCorpus:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        with (directory / "header.json").open("r") as f:
+            self.header = json.load(f)
+
+        self.vocabulary = Vocabulary.from_dict(self.header["vocabulary"])
+
+    @staticmethod
+    def is_valid(directory: Path, source_hash: str) -> bool:
+        header_path = directory / "header.json"
+        if not header_path.exists():
+            return False
+        with header_path.open("r") as f:
+            header = json.load(f)
+        return header["version"] == CORPUS_VERSION and header["hash"] == source_hash
+
+    def _open(self, path: Path, dtype, count: int) -> np.ndarray:
+        # np.memmap refuses empty files
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def split(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        sizes = self.header["splits"][name]
+        tokens = self._open(
+            self.directory / f"{name}_tokens.bin", TOKEN_DTYPE, sizes["tokens"]
+        )
+        offsets = self._open(
+            self.directory / f"{name}_offsets.bin", OFFSET_DTYPE, sizes["words"] + 1
+        )
+        return tokens, offsets
@@ -0,0 +1,133 @@
+import json
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import torch
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import DataLoader, Dataset
+
+# Bump when the on-disk layout changes, stale stores are then recomputed
+FEATURES_VERSION = 1
+FEATURE_DTYPE = np.float32
+FEATURE_NAMES = ("neural_code", "output")
+
+
+def image_ids(dataset) -> list[str]:
+    # Images are identified by their path relative to the dataset root
+    root = Path(dataset.root)
+    return [Path(path).relative_to(root).as_posix() for path, _ in dataset.samples]
+
+
+def stack_images(batch: list) -> torch.Tensor:
+    # Targets are not needed here, and can differ in length
+    return torch.stack([image for image, _ in batch])
+
+
+@torch.no_grad()
+def write_features(
+    cnn: torch.nn.Module,
+    dataset,
+    directory: Path,
+    cornet_model: str,
+    batch_size: int = 64,
+    device="cpu",
+) -> None:
+    """
+    Runs a frozen CORnet feature extractor once over every image of an
+    ImageFolder dataset and stores each of its outputs as a (images, size)
+    float32 array, row i belonging to `dataset.samples[i]`. The header is
+    written last, an interrupted run therefore never looks like a valid store.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    header_path = directory / "header.json"
+    header_path.unlink(missing_ok=True)
+
+    cnn = cnn.to(device).eval()
+    arrays = {}
+    start = 0
+    for images in DataLoader(dataset, batch_size=batch_size, collate_fn=stack_images):
+        outs = cnn(images.to(device))
+        for name in FEATURE_NAMES:
+            values = outs[name].flatten(1).cpu().numpy()
+            # Sizes are only known once the first batch went through
+            if name not in arrays:
+                arrays[name] = np.memmap(
+                    directory / f"{name}.bin",
+                    dtype=FEATURE_DTYPE,
+                    mode="w+",
+                    shape=(len(dataset), values.shape[1]),
+                )
+            arrays[name][start : start + len(values)] = values
+        start += len(images)
+
+    for array in arrays.values():
+        array.flush()
+
+    header = {
+        "version": FEATURES_VERSION,
+        "model": cornet_model.upper(),
+        "ids": image_ids(dataset),
+        "sizes": {name: array.shape[1] for name, array in arrays.items()},
+    }
+    with header_path.open("w") as f:
+        json.dump(header, f)
+
+
+class FeatureStore:
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        with (directory / "header.json").open("r") as f:
+            self.header = json.load(f)
+
+        self.ids = self.header["ids"]
+        self.id_to_index = {image_id: i for i, image_id in enumerate(self.ids)}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def is_valid(directory: Path, ids: Sequence[str], cornet_model: str) -> bool:
+        header_path = directory / "header.json"
+        if not header_path.exists():
+            return False
+        with header_path.open("r") as f:
+            header = json.load(f)
+        return (
+            header["version"] == FEATURES_VERSION
+            and header["model"] == cornet_model.upper()
+            and header["ids"] == list(ids)
+        )
+
+    def size(self, name: str) -> int:
+        return self.header["sizes"][name]
+
+    def features(self, name: str) -> np.ndarray:
+        return np.memmap(
+            self.directory / f"{name}.bin",
+            dtype=FEATURE_DTYPE,
+            mode="r",
+            shape=(len(self.ids), self.size(name)),
+        )
+
+
+class FeatureDataset(Dataset):
+    """Cached neural codes of the images with the target of each image."""
+
+    def __init__(self, store: FeatureStore, targets: Sequence[torch.Tensor]) -> None:
+        self.neural_code = store.features("neural_code")
+        self.targets = targets
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, index: int) -> tuple[torch.Tensor, torch.Tensor]:
+        code = torch.from_numpy(np.array(self.neural_code[index]))
+        return code, self.targets[index]
+
+
+def feature_collate(batch: list, pad_index: int) -> tuple:
+    codes, targets = zip(*batch)
+    # Codes share one size, targets are padded to the longest one in the batch
+    targets = pad_sequence(targets, batch_first=True, padding_value=pad_index)
+    return torch.stack(codes), targets
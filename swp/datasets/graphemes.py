@@ -3,12 +3,13 @@ from typing import Any, Callable, Iterator, Optional, Sequence, Union
 
 import numpy as np
 import torch
-from g2p_en import G2p
 from PIL import Image, ImageDraw, ImageFont
 from torch.utils.data import BatchSampler, DataLoader, Sampler, TensorDataset
 from torchvision.datasets import ImageFolder
 from torchvision.datasets.folder import default_loader
 
+from ..utils.lexicon import pronounce
+
 SCRIPT_FONTS = ["brushscriptstd", "Pacifico-Regular"]
 SANS_FONTS = ["Arial", "helvetica"]
 SERIF_FONTS = ["Times_New_Roman", "Georgia"]
@@ -362,23 +363,24 @@ class RepetitionDataset(ImageFolder):
         is_valid_file: Optional[Callable[[str], bool]] = None,
         allow_empty: bool = False,
     ):
-        g2p = G2p()
         length_to_pad = 10  # max_len + 5
 
-        def to_phoneme(word: str) -> torch.Tensor:
-            phonemes: list[str] = g2p(word)
-            phonemes.append("<STOP>")
+        def to_phoneme(phonemes: list[str]) -> torch.Tensor:
+            phonemes = phonemes + ["<STOP>"]
             phonemes.extend(["<PAD>" for _ in range(length_to_pad - len(phonemes))])
             return torch.Tensor([phoneme_to_id[phoneme] for phoneme in phonemes])
 
         super().__init__(
             root,
             transform,
-            to_phoneme,
+            None,
             loader,
             is_valid_file,
             allow_empty,
         )
+        # Pronounce each class word once, targets are looked up by class index
+        self.class_to_phonemes = [to_phoneme(p) for p in pronounce(self.classes)]
+        self.target_transform = self.class_to_phonemes.__getitem__
         self.class_to_sample_id: dict[str, list[int]] = {}
         for sample_id, class_id in enumerate(self.targets):
             self.class_to_sample_id.setdefault(self.classes[class_id], []).append(
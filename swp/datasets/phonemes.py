@@ -1,207 +1,350 @@
 import json
-import random
-import numpy as np
-import pandas as pd
-from g2p_en import G2p
+from functools import cached_property, partial
 from itertools import chain
+from pathlib import Path
+from typing import Iterator, Optional, Sequence
 
+import numpy as np
+import pandas as pd
 import torch
-from torch.utils.data import DataLoader, Dataset
-
-from ..utils.datasets import get_test_data, get_train_data
-from ..utils.paths import get_dataset_dir
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data import DataLoader, Dataset, RandomSampler, Sampler
+from torch.utils.data import SequentialSampler
 
-
-""" PATHS """
-
-
-phonemes_dir = get_dataset_dir() / "phonemes"
-phonemes_dir.mkdir(parents=True, exist_ok=True)
-train_cache = phonemes_dir / "train_phonemes.json"
-valid_cache = phonemes_dir / "valid_phonemes.json"
-stats_cache = phonemes_dir / "phoneme_stats.json"
-bigram_cache = phonemes_dir / "bigram_stats.json"
+from ..utils.datasets import TRAIN_DRAWS, get_dataframe_path, get_test_data
+from ..utils.datasets import phoneme_statistics, sample_words
+from ..utils.ngrams import NgramCounter
+from ..utils.paths import get_phonemes_dir
+from .corpus import PhonemeCorpus, hash_files, write_corpus
+from .vocabulary import Vocabulary
 
 
 """ DATASET """
 
 
 class CustomDataset(Dataset):
-    def __init__(self, phonemes):
-        # Convert phoneme sequences to tensors
-        self.data = [torch.tensor(seq) for seq in phonemes]
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray):
+        # Words are slices of the flat (memory-mapped) token array
+        self.tokens = tokens
+        self.offsets = offsets
 
     def __len__(self):
-        return len(self.data)
+        return len(self.offsets) - 1
 
     def __getitem__(self, idx):
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        seq = torch.from_numpy(self.tokens[start:end].astype(np.int64))
         # Return inputs and targets
-        return self.data[idx], self.data[idx].clone()
+        return seq, seq.clone()
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+
+def pad_collate(batch: list, pad_index: int) -> tuple:
+    inputs, targets = zip(*batch)
+    lengths = torch.tensor([len(seq) for seq in inputs])
+
+    # Pad every sequence up to the longest one in the batch
+    inputs = pad_sequence(inputs, batch_first=True, padding_value=pad_index)
+    targets = pad_sequence(targets, batch_first=True, padding_value=pad_index)
+
+    return inputs, targets, lengths
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Groups the indices drawn from `sampler` into batches of words with similar
+    lengths. Indices are pooled `batch_size * bucket_size` at a time, sorted by
+    length within the pool, cut into batches, and the batches are shuffled.
+    """
+
+    def __init__(
+        self,
+        sampler: Sampler,
+        lengths: Sequence[int],
+        batch_size: int,
+        bucket_size: int = 100,
+        shuffle: bool = True,
+        generator=None,
+    ) -> None:
+        self.sampler = sampler
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.pool_size = batch_size * bucket_size
+        self.shuffle = shuffle
+        self.generator = generator
+
+    def _batches(self, pool: list[int]) -> list[list[int]]:
+        pool_array = np.array(pool)
+        order = np.argsort(self.lengths[pool_array], kind="stable")
+        pool_array = pool_array[order]
+        batches = [
+            pool_array[i : i + self.batch_size].tolist()
+            for i in range(0, len(pool_array), self.batch_size)
+        ]
+        if self.shuffle:
+            permutation = torch.randperm(len(batches), generator=self.generator)
+            batches = [batches[i] for i in permutation.tolist()]
+        return batches
+
+    def __iter__(self) -> Iterator[list[int]]:
+        pool = []
+        for idx in self.sampler:
+            pool.append(idx)
+            if len(pool) == self.pool_size:
+                yield from self._batches(pool)
+                pool = []
+        if pool:
+            yield from self._batches(pool)
+
+    def __len__(self) -> int:
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
+
+
+def build_alias_table(weights: np.ndarray) -> tuple[torch.Tensor, torch.Tensor]:
+    """Vose's alias table: column `i` keeps `i` with `prob[i]`, else `alias[i]`."""
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)
+
+    small = np.flatnonzero(scaled < 1).tolist()
+    large = np.flatnonzero(scaled >= 1).tolist()
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] += scaled[s] - 1
+        (small if scaled[l] < 1 else large).append(l)
+
+    return torch.from_numpy(prob), torch.from_numpy(alias)
+
+
+class AliasSampler(Sampler):
+    """
+    Draws `num_samples` indices with replacement, proportionally to `weights`,
+    in O(1) per draw. Memory only grows with the number of unique words.
+    """
+
+    def __init__(self, weights: Sequence[float], num_samples: int, generator=None):
+        self.prob, self.alias = build_alias_table(np.asarray(weights))
+        self.num_samples = num_samples
+        self.generator = generator
+
+    def __iter__(self) -> Iterator[int]:
+        size = (self.num_samples,)
+        columns = torch.randint(len(self.prob), size, generator=self.generator)
+        coins = torch.rand(size, generator=self.generator, dtype=torch.float64)
+        keep = coins < self.prob[columns]
+        yield from torch.where(keep, columns, self.alias[columns]).tolist()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+def bucket_dataloader(
+    dataset: CustomDataset,
+    pad_index: int,
+    batch_size: int = 1,
+    bucket_size: int = 100,
+    shuffle: bool = False,
+    sampler: Optional[Sampler] = None,
+) -> DataLoader:
+    if sampler is None:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    batch_sampler = BucketBatchSampler(
+        sampler, dataset.lengths(), batch_size, bucket_size, shuffle=shuffle
+    )
+    collate_fn = partial(pad_collate, pad_index=pad_index)
+    return DataLoader(dataset, batch_sampler=batch_sampler, collate_fn=collate_fn)
 
 
 class Phonemes:
-    def __init__(self) -> None:
-        self.test_data = get_test_data()
+    """
+    Phoneme datasets for the repetition task. Nothing is read from disk until
+    an attribute is first accessed, and each split is then loaded only once.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 1,
+        bucket_size: int = 100,
+        epoch_size: int = TRAIN_DRAWS,
+    ) -> None:
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        # Number of frequency-weighted training draws per epoch
+        self.epoch_size = epoch_size
 
-        phonemes_dir = get_dataset_dir() / "phonemes"
         # Cache for train and validation phonemes
         # TODO add checks, better nouns, better format
-        train_cache = phonemes_dir / "train_phonemes.json"
-        valid_cache = phonemes_dir / "valid_phonemes.json"
-        stats_cache = phonemes_dir / "phoneme_stats.json"
-        bigram_cache = phonemes_dir / "bigram_stats.json"
-
-        # If cache dir exists, load phonemes and stats
-        if phonemes_dir.exists():
-            with train_cache.open("r") as f:
-                self.train_phonemes = json.load(f)
-            with valid_cache.open("r") as f:
-                self.valid_phonemes = json.load(f)
-            with stats_cache.open("r") as f:
-                self.phoneme_stats = json.load(f)
-            with bigram_cache.open("r") as f:
-                self.bigram_stats = json.load(f)
-
-        # Otherwise, generate and save phonemes to cache
-        else:
-            phonemes_dir.mkdir(parents=True, exist_ok=True)
-            self.train_phonemes, self.valid_phonemes = sample_words()
-            self.phoneme_stats, self.bigram_stats = phoneme_statistics(
-                self.train_phonemes
+        phonemes_dir = get_phonemes_dir()
+        self.train_cache = phonemes_dir / "train_phonemes.json"
+        self.valid_cache = phonemes_dir / "valid_phonemes.json"
+        self.freqs_cache = phonemes_dir / "train_frequencies.json"
+        self.stats_cache = phonemes_dir / "phoneme_stats.json"
+        self.bigram_cache = phonemes_dir / "bigram_stats.json"
+        self.corpus_dir = phonemes_dir / "corpus"
+
+    def _ensure_caches(self) -> None:
+        # Generate and save phonemes to cache if missing
+        if self.train_cache.exists() and self.valid_cache.exists():
+            return
+        train_phonemes, train_freqs, valid_phonemes = sample_words()
+        phoneme_stats, bigram_stats = phoneme_statistics(train_phonemes, train_freqs)
+        with self.train_cache.open("w") as f:
+            json.dump(train_phonemes, f)
+        with self.freqs_cache.open("w") as f:
+            json.dump(train_freqs, f)
+        with self.valid_cache.open("w") as f:
+            json.dump(valid_phonemes, f)
+        with self.stats_cache.open("w") as f:
+            json.dump(phoneme_stats, f)
+        with self.bigram_cache.open("w") as f:
+            json.dump(bigram_stats, f)
+
+    # Older caches hold pre-sampled words without frequencies, drawn uniformly
+    @cached_property
+    def has_frequencies(self) -> bool:
+        self._ensure_caches()
+        return self.freqs_cache.exists()
+
+    @cached_property
+    def train_weights(self) -> np.ndarray:
+        if not self.has_frequencies:
+            return np.ones(len(self.dataset("train")))
+        with self.freqs_cache.open("r") as f:
+            return np.array(json.load(f))
+
+    def ngram_counter(
+        self, order: int, positional: bool = False, weighted: bool = True
+    ) -> NgramCounter:
+        """N-gram counts over the encoded training split, <STOP> included."""
+        tokens, offsets = self.corpus.split("train")
+        counter = NgramCounter(self.vocab_size, order, positional)
+        weights = self.train_weights if weighted else None
+        return counter.update(tokens, offsets, weights)
+
+    @cached_property
+    def test_data(self) -> pd.DataFrame:
+        return get_test_data()
+
+    @cached_property
+    def phoneme_stats(self) -> dict:
+        self._ensure_caches()
+        with self.stats_cache.open("r") as f:
+            return json.load(f)
+
+    @cached_property
+    def bigram_stats(self) -> dict:
+        self._ensure_caches()
+        with self.bigram_cache.open("r") as f:
+            return json.load(f)
+
+    @cached_property
+    def corpus(self) -> PhonemeCorpus:
+        self._ensure_caches()
+
+        # Pack the JSON caches into a memory-mapped corpus when they changed
+        test_path = get_dataframe_path("complete_test")
+        if not test_path.exists():
+            get_test_data()
+        source_hash = hash_files([self.train_cache, self.valid_cache, test_path])
+        if not PhonemeCorpus.is_valid(self.corpus_dir, source_hash):
+            build_corpus(
+                self.corpus_dir,
+                self.train_cache,
+                self.valid_cache,
+                self.test_data,
+                source_hash,
             )
-            with train_cache.open("w") as f:
-                json.dump(self.train_phonemes, f)
-            with valid_cache.open("w") as f:
-                json.dump(self.valid_phonemes, f)
-            with stats_cache.open("w") as f:
-                json.dump(self.phoneme_stats, f)
-            with bigram_cache.open("w") as f:
-                json.dump(self.bigram_stats, f)
-
-        # Add stop token to phoneme sequences
-        train_phonemes = [seq + ["<STOP>"] for seq in self.train_phonemes]
-        valid_phonemes = [seq + ["<STOP>"] for seq in self.valid_phonemes]
-        test_phonemes = [seq + ["<STOP>"] for seq in self.test_data["Phonemes"]]
-
-        # Flatten and deduplicate lists of phonemes
-        all_phonemes = list(
-            set(chain(*train_phonemes, *valid_phonemes, *test_phonemes))
-        )
+        return PhonemeCorpus(self.corpus_dir)
 
-        # Create phoneme to index map
-        phone_to_index = {p: i + 1 for i, p in enumerate(all_phonemes)}
+    # Vocabulary is persisted with the corpus, indices are stable
+    @cached_property
+    def vocabulary(self) -> Vocabulary:
+        return self.corpus.vocabulary
 
-        # # Add start token to beginning of index map
-        phone_to_index["<SOS>"] = 0
+    @property
+    def vocab_size(self) -> int:
+        return len(self.vocabulary)
 
-        # Create index to phoneme map
-        index_to_phone = {i: p for p, i in phone_to_index.items()}
+    @property
+    def pad_index(self) -> int:
+        return self.vocabulary.pad_index
 
-        # Get vocab size
-        vocab_size = len(phone_to_index)
+    @property
+    def phone_to_index(self) -> dict[str, int]:
+        return self.vocabulary.phone_to_index
 
-        # Encode phonemes to indices
-        train_encoded = [[phone_to_index[p] for p in w] for w in train_phonemes]
-        valid_encoded = [[phone_to_index[p] for p in w] for w in valid_phonemes]
-        test_encoded = [[phone_to_index[p] for p in w] for w in test_phonemes]
+    @cached_property
+    def index_to_phone(self) -> dict[int, str]:
+        return dict(enumerate(self.vocabulary.index_to_phone))
 
-        # Inputs are same as targets because of AE architecture
-        train_dataset = CustomDataset(train_encoded)
-        valid_dataset = CustomDataset(valid_encoded)
-        test_dataset = CustomDataset(test_encoded)
-
-        # Create dataloaders
-        self.train_dataloader = DataLoader(train_dataset, shuffle=True)
-        self.valid_dataloader = DataLoader(valid_dataset, shuffle=False)
-        self.test_dataloader = DataLoader(test_dataset)
-
-        # Save attributes
-        self.vocab_size = vocab_size
-        self.phone_to_index = phone_to_index
-        self.index_to_phone = index_to_phone
+    # Inputs are same as targets because of AE architecture
+    def dataset(self, split: str) -> CustomDataset:
+        return CustomDataset(*self.corpus.split(split))
+
+    # Padded dataloaders, batching words of similar length
+    @cached_property
+    def train_dataloader(self) -> DataLoader:
+        train_dataset = self.dataset("train")
+        # Pre-sampled words of older caches are all seen once per epoch
+        sampler = None
+        if self.has_frequencies:
+            sampler = AliasSampler(self.train_weights, self.epoch_size)
+        return bucket_dataloader(
+            train_dataset,
+            self.pad_index,
+            self.batch_size,
+            self.bucket_size,
+            shuffle=True,
+            sampler=sampler,
+        )
 
+    @cached_property
+    def valid_dataloader(self) -> DataLoader:
+        return bucket_dataloader(
+            self.dataset("valid"),
+            self.pad_index,
+            self.batch_size,
+            self.bucket_size,
+            shuffle=False,
+        )
 
-#####################
+    # Test words keep their dataframe order, batches are not bucketed
+    @cached_property
+    def test_dataloader(self) -> DataLoader:
+        return DataLoader(
+            self.dataset("test"),
+            batch_size=self.batch_size,
+            collate_fn=partial(pad_collate, pad_index=self.pad_index),
+        )
 
 
-# TODO add checks, better nouns, better format
-def load_cached_train_data() -> tuple:
+def build_corpus(
+    corpus_dir: Path,
+    train_cache: Path,
+    valid_cache: Path,
+    test_data: pd.DataFrame,
+    source_hash: str,
+) -> None:
     with train_cache.open("r") as f:
         train_phonemes = json.load(f)
     with valid_cache.open("r") as f:
         valid_phonemes = json.load(f)
-    # with stats_cache.open("r") as f:
-    #     phoneme_stats = json.load(f)
-    # with bigram_cache.open("r") as f:
-    #     bigram_stats = json.load(f)
-
-    return train_phonemes, valid_phonemes
-
-
-def dump_cached_train_data(train_phonemes, valid_phonemes) -> None:
-    with train_cache.open("w") as f:
-        json.dump(train_phonemes, f)
-    with valid_cache.open("w") as f:
-        json.dump(valid_phonemes, f)
-
-    # phoneme_stats, bigram_stats = phoneme_statistics(train_phonemes)
-    # with stats_cache.open("w") as f:
-    #     json.dump(phoneme_stats, f)
-    # with bigram_cache.open("w") as f:
-    #     json.dump(bigram_stats, f)
-
-    return None
-
-
-def get_phoneme_train_data(test_data: pd.DataFrame):
-    test_data = get_test_data()
-
-    if phonemes_dir.exists():
-        train_phonemes, valid_phonemes = load_cached_train_data()
-
-    # Otherwise, generate and save phonemes to cache
-    else:
-        train_phonemes, valid_phonemes = sample_words()
-        dump_cached_train_data(train_phonemes, valid_phonemes)
 
     # Add stop token to phoneme sequences
     train_phonemes = [seq + ["<STOP>"] for seq in train_phonemes]
     valid_phonemes = [seq + ["<STOP>"] for seq in valid_phonemes]
     test_phonemes = [seq + ["<STOP>"] for seq in test_data["Phonemes"]]
 
-    # Flatten and deduplicate lists of phonemes
-    all_phonemes = list(set(chain(*train_phonemes, *valid_phonemes, *test_phonemes)))
-
-    # Create phoneme to index map
-    phone_to_index = {p: i + 1 for i, p in enumerate(all_phonemes)}
-
-    # # Add start token to beginning of index map
-    phone_to_index["<SOS>"] = 0
-
-    # Create index to phoneme map
-    index_to_phone = {i: p for p, i in phone_to_index.items()}
-
-    # Get vocab size
-    vocab_size = len(phone_to_index)
-
-    # Encode phonemes to indices
-    train_encoded = [[phone_to_index[p] for p in w] for w in train_phonemes]
-    valid_encoded = [[phone_to_index[p] for p in w] for w in valid_phonemes]
-    test_encoded = [[phone_to_index[p] for p in w] for w in test_phonemes]
-
-    # Inputs are same as targets because of AE architecture
-    train_dataset = CustomDataset(train_encoded)
-    valid_dataset = CustomDataset(valid_encoded)
-    test_dataset = CustomDataset(test_encoded)
-
-    # Create dataloaders
-    train_dataloader = DataLoader(train_dataset, shuffle=True)
-    valid_dataloader = DataLoader(valid_dataset, shuffle=False)
-    test_dataloader = DataLoader(test_dataset)
-
-    # Save attributes
-    vocab_size = vocab_size
-    phone_to_index = phone_to_index
-    index_to_phone = index_to_phone
+    # Sorted vocabulary with reserved <SOS>, <STOP> and <PAD> indices
+    vocabulary = Vocabulary(chain(*train_phonemes, *valid_phonemes, *test_phonemes))
 
-    return
+    splits = {
+        "train": train_phonemes,
+        "valid": valid_phonemes,
+        "test": test_phonemes,
+    }
+    write_corpus(corpus_dir, splits, vocabulary, source_hash)
@@ -0,0 +1,117 @@
+import json
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import torch
+
+# Bump when the index layout changes
+VOCABULARY_VERSION = 1
+
+SOS = "<SOS>"
+STOP = "<STOP>"
+PAD = "<PAD>"
+SPECIAL_TOKENS = [SOS, STOP, PAD]
+
+
+class Vocabulary:
+    """
+    Phoneme <-> index mapping. Special tokens take the first indices and the
+    phonemes follow in sorted order, so the same phoneme set always gives the
+    same indices regardless of the process that built it.
+    """
+
+    def __init__(self, phonemes: Iterable[str]) -> None:
+        phones = sorted(set(phonemes) - set(SPECIAL_TOKENS))
+        self.index_to_phone = SPECIAL_TOKENS + phones
+        self.phone_to_index = {p: i for i, p in enumerate(self.index_to_phone)}
+        self._phones = np.array(self.index_to_phone, dtype=object)
+
+    def __len__(self) -> int:
+        return len(self.index_to_phone)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Vocabulary):
+            return NotImplemented
+        return self.index_to_phone == other.index_to_phone
+
+    @property
+    def sos_index(self) -> int:
+        return self.phone_to_index[SOS]
+
+    @property
+    def stop_index(self) -> int:
+        return self.phone_to_index[STOP]
+
+    @property
+    def pad_index(self) -> int:
+        return self.phone_to_index[PAD]
+
+    def encode_flat(self, phonemes: Sequence[str]) -> np.ndarray:
+        # Look each distinct phoneme up once, then broadcast back
+        if len(phonemes) == 0:
+            return np.empty(0, dtype=np.int64)
+        uniques, inverse = np.unique(np.asarray(phonemes), return_inverse=True)
+        codes = np.array([self.phone_to_index[p] for p in uniques], dtype=np.int64)
+        return codes[inverse]
+
+    def encode_batch(
+        self, sequences: Sequence[Sequence[str]], add_stop: bool = True
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Encodes words into a (batch, max_len) array padded with <PAD>."""
+        lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+        codes = self.encode_flat(list(chain.from_iterable(sequences)))
+
+        max_len = int(lengths.max(initial=0)) + int(add_stop)
+        padded = np.full((len(sequences), max_len), self.pad_index, dtype=np.int64)
+        mask = np.arange(max_len) < lengths[:, None]
+        padded[mask] = codes
+
+        if add_stop:
+            padded[np.arange(len(sequences)), lengths] = self.stop_index
+            lengths = lengths + 1
+
+        return padded, lengths
+
+    def decode_batch(
+        self, indices, lengths: Optional[Sequence[int]] = None
+    ) -> list[list[str]]:
+        """
+        Decodes a (batch, len) array or tensor of indices. Without lengths,
+        each word is cut at its first <STOP> or <PAD>.
+        """
+        if isinstance(indices, torch.Tensor):
+            indices = indices.cpu().numpy()
+        indices = np.atleast_2d(indices)
+        phones = self._phones[indices]
+
+        if lengths is None:
+            ends = (indices == self.stop_index) | (indices == self.pad_index)
+            lengths = np.where(ends.any(axis=1), ends.argmax(axis=1), ends.shape[1])
+
+        return [row[:length].tolist() for row, length in zip(phones, lengths)]
+
+    def to_dict(self) -> dict:
+        return {"version": VOCABULARY_VERSION, "phonemes": self.index_to_phone}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Vocabulary":
+        if data["version"] != VOCABULARY_VERSION:
+            raise ValueError(
+                f"Vocabulary version {data['version']} is not supported, "
+                f"expected {VOCABULARY_VERSION}"
+            )
+        vocabulary = cls(data["phonemes"])
+        if vocabulary.index_to_phone != data["phonemes"]:
+            raise ValueError("Stored vocabulary is not in canonical order")
+        return vocabulary
+
+    def save(self, path: Path) -> None:
+        with path.open("w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: Path) -> "Vocabulary":
+        with path.open("r") as f:
+            return cls.from_dict(json.load(f))
@@ -1,40 +1,130 @@
+from typing import Optional, Sequence
+
+import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+from .decoders import DecoderLSTM
+from .encoders import EncoderCNN
+
+
+def visual_state(hidden: torch.Tensor, decoder: nn.Module):
+    # One copy of the image code per decoder layer, LSTM cells start at zero
+    hidden = hidden.unsqueeze(0).repeat(decoder.num_layers, 1, 1)
+    if isinstance(decoder, DecoderLSTM):
+        return hidden, torch.zeros_like(hidden)
+    return hidden
+
+
+def concat_states(states: Sequence):
+    # Stack encoder states along the batch dimension, (hidden, cell) or hidden
+    if isinstance(states[0], tuple):
+        return tuple(torch.cat(parts, dim=1) for parts in zip(*states))
+    return torch.cat(states, dim=1)
+
+
+def concat_targets(targets: Sequence[torch.Tensor], pad_index: int) -> torch.Tensor:
+    # Pad (batch, len) targets to the longest one before stacking them
+    length = max(target.size(1) for target in targets)
+    return torch.cat(
+        [F.pad(t, (0, length - t.size(1)), value=pad_index) for t in targets]
+    )
+
+
+def decode(decoder: nn.Module, state, target, tf_ratio, start_token: int):
+    start = torch.full(
+        (target.size(0), 1), start_token, dtype=torch.long, device=target.device
+    )
+    if isinstance(state, tuple):
+        return decoder(start, *state, target, tf_ratio)
+    return decoder(start, state, target, tf_ratio)
 
 
 class Unimodel(nn.Module):
-    def __init__(self, encoder: nn.Module, decoder: nn.Module):
+    def __init__(self, encoder: nn.Module, decoder: nn.Module, start_token: int = 0):
         super(Unimodel, self).__init__()
         self.encoder = encoder
         self.decoder = decoder
+        self.start_token = start_token
         self.bind()
 
-    def forward(self, input):
-        hidden = self.encoder(input)
-        out = self.decoder(hidden)
-        return out
+    def encode(self, input, lengths=None, features=False):
+        # Visual inputs are images, or cached CORnet codes with features=True
+        if isinstance(self.encoder, EncoderCNN):
+            if features:
+                _, hidden = self.encoder.from_features(input)
+            else:
+                _, hidden = self.encoder(input)
+            return visual_state(hidden, self.decoder)
+        return self.encoder(input, lengths)
+
+    def forward(self, input, target, tf_ratio, lengths=None, features=False):
+        state = self.encode(input, lengths, features)
+        return decode(self.decoder, state, target, tf_ratio, self.start_token)
 
     def bind(self):
-        # TODO check if there is a better way to load shared weights
-        # some code to share wieghts
-        pass
+        # Phoneme encoders read with the decoder's tied embedding
+        if hasattr(self.encoder, "embedding"):
+            self.encoder.embedding = self.decoder.embedding
 
 
 class Bimodel(nn.Module):
+    """
+    Auditory and visual encoders feeding one shared decoder. A batch can
+    hold both modalities: their states are stacked and decoded in one pass,
+    phoneme samples first.
+    """
+
     def __init__(
-        self, audit_encoder: nn.Module, visual_encoder: nn.Module, decoder: nn.Module
+        self,
+        audit_encoder: nn.Module,
+        visual_encoder: nn.Module,
+        decoder: nn.Module,
+        start_token: int = 0,
     ):
         super(Bimodel, self).__init__()
         self.audit_encoder = audit_encoder
-        self.visual_decoder = visual_encoder
+        self.visual_encoder = visual_encoder
         self.decoder = decoder
+        self.start_token = start_token
         self.bind()
 
-    def forward(self, input):
-        hidden = self.encoder(input)
-        out = self.decoder(hidden)
-        return out
+    def encode(
+        self,
+        phonemes: Optional[torch.Tensor] = None,
+        lengths: Optional[torch.Tensor] = None,
+        images: Optional[torch.Tensor] = None,
+        features: bool = False,
+    ):
+        states = []
+        if phonemes is not None:
+            states.append(self.audit_encoder(phonemes, lengths))
+        if images is not None:
+            if features:
+                _, hidden = self.visual_encoder.from_features(images)
+            else:
+                _, hidden = self.visual_encoder(images)
+            states.append(visual_state(hidden, self.decoder))
+        return concat_states(states)
+
+    def forward(
+        self,
+        target: torch.Tensor,
+        tf_ratio: float,
+        phonemes: Optional[torch.Tensor] = None,
+        lengths: Optional[torch.Tensor] = None,
+        images: Optional[torch.Tensor] = None,
+        features: bool = False,
+    ) -> torch.Tensor:
+        """
+        Decodes phoneme inputs (with their lengths) and images, or cached
+        CORnet codes with features=True. `target` holds the phoneme targets
+        first and the image targets after, see `concat_targets`.
+        """
+        state = self.encode(phonemes, lengths, images, features)
+        return decode(self.decoder, state, target, tf_ratio, self.start_token)
 
     def bind(self):
-        # TODO check if there is a better way to load shared weights
-        # some code to share wieghts
-        pass
+        # Phoneme encoders read with the decoder's tied embedding
+        if hasattr(self.audit_encoder, "embedding"):
+            self.audit_encoder.embedding = self.decoder.embedding
@@ -1,9 +1,12 @@
-from random import random
-
 import torch
 import torch.nn as nn
 
 
+def teacher_forcing_mask(target: torch.Tensor, tf_ratio: float) -> torch.Tensor:
+    # True where the next input is the target rather than the prediction
+    return torch.rand(target.shape, device=target.device) < tf_ratio
+
+
 class DecoderLSTM(nn.Module):
     def __init__(self, hidden_size, vocab_size, num_layers, dropout, shared_embedding):
         super(DecoderLSTM, self).__init__()
@@ -15,39 +18,82 @@ class DecoderLSTM(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.lstm = nn.LSTM(hidden_size, hidden_size, num_layers, batch_first=True)
 
-    def forward(self, x, hidden, cell, target, tf_ratio):
-        length = target.size(1)
-        logits = []
+        # Replaced by an int8 copy of the tied weights in quantized inference
+        self.projection = None
 
-        for i in range(length):
+    def project(self, output):
+        if self.projection is not None:
+            return self.projection(output)
+        return output @ self.embedding.weight.T
 
-            # Start token
-            if i == 0:
-                x = self.embedding(x)
+    def teacher_forced(self, x, hidden, cell, target, return_hidden=False):
+        # All inputs are known, run the whole sequence in a single call
+        start = self.embedding(x)
+        inputs = self.dropout(self.embedding(target[:, :-1]))
+        inputs = torch.cat([start, inputs], dim=1)
 
-            # Teacher forcing
-            elif tf_ratio > random():
-                x = self.embedding(target[:, i].unsqueeze(1))
-                x = self.dropout(x)
+        output, _ = self.lstm(inputs, (hidden, cell))
+        if return_hidden:
+            return output
 
-            # No teacher forcing
-            else:
-                # if self.training:
-                #     probs = F.softmax(output, dim=2)
-                #     x = probs @ self.embedding.weight
-                x = self.embedding(output.argmax(dim=2))
-                x = self.dropout(x)
+        return self.project(output)
+
+    def step(self, x, state):
+        # Single free-running step, state is (hidden, cell)
+        output, state = self.lstm(self.embedding(x), state)
+        return self.project(output), state
+
+    def free_running(self, x, hidden, cell, length, return_hidden=False):
+        # Every input after the start token is the previous prediction
+        target = x.new_zeros(x.size(0), length)
+        return self.forward(x, hidden, cell, target, 0, return_hidden)
+
+    def forward(self, x, hidden, cell, target, tf_ratio, return_hidden=False):
+        if tf_ratio >= 1:
+            return self.teacher_forced(x, hidden, cell, target, return_hidden)
+
+        # Teacher forcing is drawn per sequence and per step
+        use_target = teacher_forcing_mask(target, tf_ratio)
+
+        # Steps where every sequence is teacher forced need no prediction
+        forced = use_target.all(dim=0).tolist()
+
+        # Without teacher forcing, the logits of each step are the output
+        keep_logits = not return_hidden and not use_target.any()
+
+        # Start token
+        x = self.embedding(x)
+        outputs = []
+
+        for i in range(target.size(1)):
 
             # Forward pass
             output, (hidden, cell) = self.lstm(x, (hidden, cell))
 
-            # Compute logits
-            output = output @ self.embedding.weight.T
-            logits.append(output)
+            if keep_logits:
+                output = self.project(output)
+                predicted = output.detach().argmax(dim=2)
+            elif not forced[i]:
+                # Predictions only choose the next input, they need no gradient
+                with torch.no_grad():
+                    predicted = self.project(output).argmax(dim=2)
+            outputs.append(output)
+
+            # Next input is either the target or the prediction
+            if forced[i]:
+                tokens = target[:, i : i + 1]
+            else:
+                tokens = torch.where(
+                    use_target[:, i : i + 1], target[:, i : i + 1], predicted
+                )
+            x = self.dropout(self.embedding(tokens))
 
-        outputs = torch.cat(logits, dim=1)
+        outputs = torch.cat(outputs, dim=1)
+        if keep_logits or return_hidden:
+            return outputs
 
-        return outputs
+        # Logits of every step in a single projection
+        return self.project(outputs)
 
 
 class DecoderRNN(nn.Module):
@@ -58,39 +104,82 @@ class DecoderRNN(nn.Module):
         self.num_layers = num_layers
 
         self.embedding = shared_embedding
-        self.droupout = nn.Dropout(dropout)
+        self.dropout = nn.Dropout(dropout)
         self.rnn = nn.RNN(hidden_size, hidden_size, num_layers, batch_first=True)
 
-    def forward(self, x, hidden, target, tf_ratio):
-        length = target.size(1)
-        logits = []
+        # Replaced by an int8 copy of the tied weights in quantized inference
+        self.projection = None
 
-        for i in range(length):
+    def project(self, output):
+        if self.projection is not None:
+            return self.projection(output)
+        return output @ self.embedding.weight.T
 
-            # Start token
-            if i == 0:
-                x = self.embedding(x)
+    def teacher_forced(self, x, hidden, target, return_hidden=False):
+        # All inputs are known, run the whole sequence in a single call
+        start = self.embedding(x)
+        inputs = self.dropout(self.embedding(target[:, :-1]))
+        inputs = torch.cat([start, inputs], dim=1)
 
-            # Teacher forcing
-            elif tf_ratio > random():
-                x = self.embedding(target[:, i].unsqueeze(1))
-                x = self.dropout(x)
+        output, _ = self.rnn(inputs, hidden)
+        if return_hidden:
+            return output
 
-            # No teacher forcing
-            else:
-                # if self.training:
-                #     probs = F.softmax(output, dim=2)
-                #     x = probs @ self.embedding.weight
-                x = self.embedding(output.argmax(dim=2))
-                x = self.dropout(x)
+        return self.project(output)
+
+    def step(self, x, state):
+        # Single free-running step, state is the hidden tensor
+        output, state = self.rnn(self.embedding(x), state)
+        return self.project(output), state
+
+    def free_running(self, x, hidden, length, return_hidden=False):
+        # Every input after the start token is the previous prediction
+        target = x.new_zeros(x.size(0), length)
+        return self.forward(x, hidden, target, 0, return_hidden)
+
+    def forward(self, x, hidden, target, tf_ratio, return_hidden=False):
+        if tf_ratio >= 1:
+            return self.teacher_forced(x, hidden, target, return_hidden)
+
+        # Teacher forcing is drawn per sequence and per step
+        use_target = teacher_forcing_mask(target, tf_ratio)
+
+        # Steps where every sequence is teacher forced need no prediction
+        forced = use_target.all(dim=0).tolist()
+
+        # Without teacher forcing, the logits of each step are the output
+        keep_logits = not return_hidden and not use_target.any()
+
+        # Start token
+        x = self.embedding(x)
+        outputs = []
+
+        for i in range(target.size(1)):
 
             # Forward pass
             output, hidden = self.rnn(x, hidden)
 
-            # Compute logits
-            output = output @ self.embedding.weight.T
-            logits.append(output)
+            if keep_logits:
+                output = self.project(output)
+                predicted = output.detach().argmax(dim=2)
+            elif not forced[i]:
+                # Predictions only choose the next input, they need no gradient
+                with torch.no_grad():
+                    predicted = self.project(output).argmax(dim=2)
+            outputs.append(output)
+
+            # Next input is either the target or the prediction
+            if forced[i]:
+                tokens = target[:, i : i + 1]
+            else:
+                tokens = torch.where(
+                    use_target[:, i : i + 1], target[:, i : i + 1], predicted
+                )
+            x = self.dropout(self.embedding(tokens))
 
-        outputs = torch.cat(logits, dim=1)
+        outputs = torch.cat(outputs, dim=1)
+        if keep_logits or return_hidden:
+            return outputs
 
-        return outputs
+        # Logits of every step in a single projection
+        return self.project(outputs)
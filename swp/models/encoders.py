@@ -1,18 +1,22 @@
-from typing import Callable, Type, Union
+from typing import Callable, Optional, Type, Union
 
 import torch
 import torch.nn as nn
-from torch.utils.model_zoo import load_url
-from torchvision.models.feature_extraction import create_feature_extractor
+from torch.nn.utils.rnn import pack_padded_sequence
 
-from .cornet_r import HASH as HASH_R
-from .cornet_r import CORnet_R
-from .cornet_rt import HASH as HASH_RT
-from .cornet_rt import CORnet_RT
-from .cornet_s import HASH as HASH_S
-from .cornet_s import CORnet_S
-from .cornet_z import HASH as HASH_Z
-from .cornet_z import CORnet_Z
+from ..utils.models import load_cornet_state_dict
+
+# Size of the flattened IT output of every CORnet variant
+CORNET_CODE_SIZE = 512
+
+
+def pack(embedded: torch.Tensor, lengths: Optional[torch.Tensor]):
+    # Padding steps are skipped, final states come from each last real step
+    if lengths is None:
+        return embedded
+    return pack_padded_sequence(
+        embedded, lengths.cpu(), batch_first=True, enforce_sorted=False
+    )
 
 
 class EncoderRNN(nn.Module):
@@ -26,8 +30,8 @@ class EncoderRNN(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.rnn = nn.RNN(hidden_size, hidden_size, num_layers, batch_first=True)
 
-    def forward(self, x):
-        embedded = self.dropout(self.embedding(x))
+    def forward(self, x, lengths=None):
+        embedded = pack(self.dropout(self.embedding(x)), lengths)
         _, hidden = self.rnn(embedded)
 
         return hidden
@@ -44,8 +48,8 @@ class EncoderLSTM(nn.Module):
         self.dropout = nn.Dropout(dropout)
         self.lstm = nn.LSTM(hidden_size, hidden_size, num_layers, batch_first=True)
 
-    def forward(self, x):
-        embedded = self.dropout(self.embedding(x))
+    def forward(self, x, lengths=None):
+        embedded = pack(self.dropout(self.embedding(x)), lengths)
         _, (hidden, cell) = self.lstm(embedded)
 
         return hidden, cell
@@ -56,6 +60,22 @@ def cornet_loader(
     pretrained: bool = True,
     map_location=None,
 ) -> nn.Module:
+    # Visual models are only imported when a CNN encoder is built
+    try:
+        from .cornet_r import HASH as HASH_R
+        from .cornet_r import CORnet_R
+        from .cornet_rt import HASH as HASH_RT
+        from .cornet_rt import CORnet_RT
+        from .cornet_s import HASH as HASH_S
+        from .cornet_s import CORnet_S
+        from .cornet_z import HASH as HASH_Z
+        from .cornet_z import CORnet_Z
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            "The CORnet models link to the CORnet submodule, "
+            "run `git submodule update --init` first"
+        ) from e
+
     model_code = model_letter.upper()
     model_class: Union[Type[nn.Module], Callable[[], nn.Module]]
     if model_code == "R":
@@ -76,30 +96,42 @@ def cornet_loader(
         )
     model = model_class()
     if pretrained:
-        url = f"https://s3.amazonaws.com/cornet-models/cornet_{model_letter.lower()}-{model_hash}.pth"
-        ckpt_data = load_url(url, map_location=map_location)
-        state_dict = ckpt_data["state_dict"]
-        new_state_dict = {k.removeprefix("module."): v for (k, v) in state_dict.items()}
-        model.load_state_dict(new_state_dict)
+        state_dict = load_cornet_state_dict(model_code, model_hash, map_location)
+        model.load_state_dict(state_dict)
     return model
 
 
+def cornet_features(cornet_model: str) -> nn.Module:
+    # CORnet returning its flattened IT code and its class logits
+    from torchvision.models.feature_extraction import create_feature_extractor
+
+    cornet = cornet_loader(cornet_model)
+
+    return_nodes = {
+        "decoder.flatten.view": "neural_code",
+        "decoder.linear": "output",
+    }
+
+    return create_feature_extractor(cornet, return_nodes=return_nodes)
+
+
 class EncoderCNN(nn.Module):
-    def __init__(self, hidden_size, cornet_model):
+    def __init__(self, hidden_size, cornet_model, backbone=True):
         super(EncoderCNN, self).__init__()
-        cornet = cornet_loader(cornet_model)
+        # Without backbone the encoder runs on cached CORnet features only
+        self.cnn = None
+        code_size = CORNET_CODE_SIZE
+        if backbone:
+            self.cnn = cornet_features(cornet_model)
+            code_size = self.cnn.decoder.linear.in_features
 
-        return_nodes = {
-            "decoder.flatten.view": "neural_code",
-            "decoder.linear": "output",
-        }
+        self.to_hidden = nn.Linear(code_size, hidden_size)
 
-        self.cnn = create_feature_extractor(cornet, return_nodes=return_nodes)
-        self.to_hidden = nn.Linear(self.cnn.decoder.linear.in_features, hidden_size)
+    def from_features(
+        self, neural_code: torch.Tensor, output: Optional[torch.Tensor] = None
+    ) -> tuple[Optional[torch.Tensor], torch.Tensor]:
+        return output, self.to_hidden(neural_code)
 
     def forward(self, x: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor]:
         cnn_outs = self.cnn(x)
-        image_class_prediction = cnn_outs["output"]
-        hidden = self.to_hidden(cnn_outs["neural_code"])
-
-        return image_class_prediction, hidden
+        return self.from_features(cnn_outs["neural_code"], cnn_outs["output"])
@@ -0,0 +1,163 @@
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import torch
+import torch.nn as nn
+from torch.nn.utils.rnn import pack_padded_sequence
+
+from ..datasets.vocabulary import Vocabulary
+from ..utils.models import load_weigths, parse_model_name
+from ..utils.paths import get_weights_dir
+from .decoders import DecoderLSTM
+from .encoders import EncoderLSTM
+from .inference import ctc_collapse
+
+
+class RepetitionModel(nn.Module):
+    """
+    Embedding, LSTM encoder and greedy decoder of a trained repetition model
+    in a single TorchScript-compatible module. The vocabulary travels with the
+    weights, so a scripted copy only needs `torch.jit.load` to run. Outputs of
+    CTC-trained models are collapsed, with <PAD> as the blank.
+    Like `swp.test.repetition.repeat`, words are decoded for at most
+    2 * max(lengths) + 1 steps, so both agree on words that never stop.
+    """
+
+    def __init__(
+        self,
+        embedding: nn.Embedding,
+        encoder: EncoderLSTM,
+        decoder: DecoderLSTM,
+        vocabulary: Vocabulary,
+        ctc: bool = False,
+    ) -> None:
+        super(RepetitionModel, self).__init__()
+        self.embedding = embedding
+        self.encoder = encoder.lstm
+        self.decoder = decoder.lstm
+        self.ctc = ctc
+
+        self.index_to_phone: List[str] = list(vocabulary.index_to_phone)
+        self.phone_to_index: Dict[str, int] = dict(vocabulary.phone_to_index)
+        self.sos_index = vocabulary.sos_index
+        self.stop_index = vocabulary.stop_index
+        self.pad_index = vocabulary.pad_index
+
+    def forward(
+        self, inputs: torch.Tensor, lengths: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Repeats a (batch, len) padded batch of phoneme indices. Returns the
+        predictions padded with <PAD> and their lengths, <STOP> included.
+        """
+        embedded = pack_padded_sequence(
+            self.embedding(inputs),
+            lengths.cpu(),
+            batch_first=True,
+            enforce_sorted=False,
+        )
+        _, (hidden, cell) = self.encoder(embedded)
+
+        batch_size = inputs.size(0)
+        device = inputs.device
+        max_length = 2 * int(lengths.max()) + 1
+        x = torch.full((batch_size, 1), self.sos_index, dtype=torch.long, device=device)
+        predictions = torch.full(
+            (batch_size, max_length),
+            self.pad_index,
+            dtype=torch.long,
+            device=device,
+        )
+        out_lengths = torch.full(
+            (batch_size,), max_length, dtype=torch.long, device=device
+        )
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+        steps = 0
+        for i in range(max_length):
+            output, (hidden, cell) = self.decoder(self.embedding(x), (hidden, cell))
+            x = (output @ self.embedding.weight.T).argmax(dim=2)
+
+            tokens = x.squeeze(1)
+            predictions[:, i] = tokens.masked_fill(finished, self.pad_index)
+
+            stopped = (tokens == self.stop_index) & ~finished
+            out_lengths[stopped] = i + 1
+            finished |= stopped
+            steps = i + 1
+            if bool(finished.all()):
+                break
+
+        if self.ctc:
+            return ctc_collapse(predictions[:, :steps], out_lengths, self.pad_index)
+        return predictions[:, :steps], out_lengths
+
+    @torch.jit.export
+    def encode(self, words: List[List[str]]) -> Tuple[torch.Tensor, torch.Tensor]:
+        # Words as phoneme lists, <STOP> is appended as during training
+        max_length = 1
+        for word in words:
+            max_length = max(max_length, len(word) + 1)
+
+        inputs = torch.full((len(words), max_length), self.pad_index, dtype=torch.long)
+        lengths = torch.zeros(len(words), dtype=torch.long)
+        for i, word in enumerate(words):
+            for j, phone in enumerate(word):
+                inputs[i, j] = self.phone_to_index[phone]
+            inputs[i, len(word)] = self.stop_index
+            lengths[i] = len(word) + 1
+
+        return inputs, lengths
+
+    @torch.jit.export
+    def decode(
+        self, predictions: torch.Tensor, lengths: torch.Tensor
+    ) -> List[List[str]]:
+        # <STOP> is dropped from the returned phonemes
+        rows: List[List[int]] = predictions.tolist()
+        sizes: List[int] = lengths.tolist()
+
+        words: List[List[str]] = []
+        for row, length in zip(rows, sizes):
+            word: List[str] = []
+            for index in row[:length]:
+                if index != self.stop_index:
+                    word.append(self.index_to_phone[index])
+            words.append(word)
+        return words
+
+    @torch.jit.export
+    def repeat(self, words: List[List[str]]) -> List[List[str]]:
+        inputs, lengths = self.encode(words)
+        predictions, out_lengths = self.forward(inputs, lengths)
+        return self.decode(predictions, out_lengths)
+
+
+def export_repetition(
+    model: str, epoch: Union[int, str], path: Optional[Path] = None
+) -> Path:
+    """
+    Scripts the weights of `model` at `epoch` into a standalone TorchScript
+    file, saved next to the weights unless `path` is given.
+    """
+    params = parse_model_name(model)
+    h_size, n_layers = params["hidden_size"], params["num_layers"]
+    dropout, ctc = params["dropout"], params["loss"] == "ctc"
+
+    model_weights_dir = get_weights_dir() / model
+    vocabulary = Vocabulary.load(model_weights_dir / "vocabulary.json")
+    vocab_size = len(vocabulary)
+
+    embedding = nn.Embedding(vocab_size, h_size)
+    encoder = EncoderLSTM(vocab_size, h_size, n_layers, dropout, embedding)
+    decoder = DecoderLSTM(h_size, vocab_size, n_layers, dropout, embedding)
+    load_weigths(model_weights_dir, embedding, encoder, decoder, epoch, "cpu")
+
+    scripted = torch.jit.script(
+        RepetitionModel(embedding, encoder, decoder, vocabulary, ctc=ctc).eval()
+    )
+
+    if path is None:
+        path = model_weights_dir / f"repetition{epoch}.pt"
+    torch.jit.save(scripted, str(path))
+    return path
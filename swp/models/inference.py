@@ -0,0 +1,200 @@
+import copy
+from typing import Union
+
+import torch
+import torch.nn as nn
+
+from ..datasets.vocabulary import Vocabulary
+
+# Longer than any word in the lexicons, leaves room for insertions
+MAX_LENGTH = 40
+
+# (hidden, cell) for LSTM decoders, hidden for RNN decoders
+State = Union[torch.Tensor, tuple[torch.Tensor, torch.Tensor]]
+
+
+def quantize(encoder: nn.Module, decoder: nn.Module) -> tuple[nn.Module, nn.Module]:
+    """
+    Int8 dynamically quantized copies of an encoder and its decoder, for CPU
+    inference. LSTM weights and the tied output projection are quantized, the
+    embedding lookup stays in fp32. PyTorch has no dynamic kernel for nn.RNN,
+    so RNN models only get a quantized projection.
+    """
+    from torch.ao.quantization import quantize_dynamic
+
+    # Copy both together and quantize in place, so they keep sharing one embedding
+    encoder, decoder = copy.deepcopy((encoder, decoder))
+    quantize_dynamic(encoder, {nn.LSTM}, dtype=torch.qint8, inplace=True)
+    quantize_dynamic(decoder, {nn.LSTM}, dtype=torch.qint8, inplace=True)
+
+    weight = decoder.embedding.weight
+    projection = nn.Linear(weight.size(1), weight.size(0), bias=False)
+    projection.weight = nn.Parameter(weight.detach().clone())
+    decoder.projection = quantize_dynamic(
+        nn.Sequential(projection), {nn.Linear}, dtype=torch.qint8
+    )
+
+    return encoder.eval(), decoder.eval()
+
+
+def state_batch_size(state: State) -> int:
+    hidden = state[0] if isinstance(state, tuple) else state
+    return hidden.size(1)
+
+
+@torch.no_grad()
+def greedy_decode(
+    decoder,
+    state: State,
+    vocabulary: Vocabulary,
+    max_length: int = MAX_LENGTH,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Decodes a batch of encoder states greedily. Each sequence stops at its
+    first <STOP>, and the loop ends once every sequence has stopped or after
+    `max_length` steps. Returns (batch, len) predictions padded with <PAD>
+    and the lengths, which include the <STOP> of sequences that emitted it.
+    """
+    batch_size = state_batch_size(state)
+    device = decoder.embedding.weight.device
+
+    x = torch.full((batch_size, 1), vocabulary.sos_index, device=device)
+    predictions = torch.full(
+        (batch_size, max_length), vocabulary.pad_index, device=device
+    )
+    lengths = torch.full((batch_size,), max_length, device=device)
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+
+    for i in range(max_length):
+        logits, state = decoder.step(x, state)
+        x = logits.argmax(dim=2)
+
+        # Finished sequences keep running but their outputs are dropped
+        tokens = x.squeeze(1)
+        predictions[:, i] = tokens.masked_fill(finished, vocabulary.pad_index)
+
+        stopped = (tokens == vocabulary.stop_index) & ~finished
+        lengths[stopped] = i + 1
+        finished |= stopped
+        if finished.all():
+            break
+
+    return predictions[:, : i + 1], lengths
+
+
+def ctc_collapse(
+    predictions: torch.Tensor, lengths: torch.Tensor, blank: int
+) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Turns the outputs of a CTC-trained decoder into phonemes: repeated
+    tokens are merged, then blanks are dropped. Takes and returns (batch, len)
+    predictions padded with `blank` and their lengths.
+    """
+    positions = torch.arange(predictions.size(1), device=predictions.device)
+    previous = torch.cat(
+        [torch.full_like(predictions[:, :1], -1), predictions[:, :-1]], dim=1
+    )
+    keep = (predictions != blank) & (predictions != previous)
+    keep &= positions < lengths[:, None]
+
+    # Kept tokens move to the front of their row
+    new_lengths = keep.sum(dim=1)
+    collapsed = torch.full_like(predictions, blank)
+    rows = torch.arange(predictions.size(0), device=predictions.device)
+    rows = rows[:, None].expand_as(predictions)
+    collapsed[rows[keep], (keep.cumsum(dim=1) - 1)[keep]] = predictions[keep]
+
+    width = int(new_lengths.max()) if len(new_lengths) > 0 else 0
+    return collapsed[:, :width], new_lengths
+
+
+def unpad(predictions: torch.Tensor, lengths: torch.Tensor) -> list[list[int]]:
+    """Splits padded predictions into ragged lists of indices."""
+    return [
+        row[:length]
+        for row, length in zip(predictions.cpu().tolist(), lengths.cpu().tolist())
+    ]
+
+
+def reorder_state(state: State, index: torch.Tensor) -> State:
+    # Gather along the batch dimension of (layers, batch, hidden) tensors
+    if isinstance(state, tuple):
+        return tuple(s.index_select(1, index) for s in state)
+    return state.index_select(1, index)
+
+
+@torch.no_grad()
+def beam_search(
+    decoder,
+    state: State,
+    vocabulary: Vocabulary,
+    beam_size: int = 5,
+    max_length: int = MAX_LENGTH,
+    length_penalty: float = 1.0,
+    n_best: int = 1,
+) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Decodes a batch of encoder states with a beam search run on all
+    (batch * beam) hypotheses at once. Finished hypotheses stay in the beam
+    with a constant score. Hypotheses are ranked by log-probability divided
+    by length ** length_penalty. Returns the `n_best` hypotheses of each word
+    as (batch, n_best, len) predictions padded with <PAD>, their lengths and
+    their total log-probabilities.
+    """
+    batch_size = state_batch_size(state)
+    device = decoder.embedding.weight.device
+    flat_size = batch_size * beam_size
+    offsets = torch.arange(batch_size, device=device)[:, None] * beam_size
+
+    state = reorder_state(
+        state, torch.arange(batch_size, device=device).repeat_interleave(beam_size)
+    )
+    x = torch.full((flat_size, 1), vocabulary.sos_index, device=device)
+
+    # Only the first beam is live at the start, the others are copies of it
+    scores = torch.full((batch_size, beam_size), float("-inf"), device=device)
+    scores[:, 0] = 0
+    predictions = torch.empty(
+        (batch_size, beam_size, 0), dtype=torch.long, device=device
+    )
+    lengths = torch.full((batch_size, beam_size), max_length, device=device)
+    finished = torch.zeros((batch_size, beam_size), dtype=torch.bool, device=device)
+
+    for i in range(max_length):
+        logits, state = decoder.step(x, state)
+        log_probs = logits.squeeze(1).log_softmax(dim=-1)
+        log_probs = log_probs.view(batch_size, beam_size, -1)
+        vocab_size = log_probs.size(-1)
+
+        # Finished hypotheses can only be extended with <PAD>, at no cost
+        padding = torch.full_like(log_probs[0, 0], float("-inf"))
+        padding[vocabulary.pad_index] = 0
+        log_probs = torch.where(finished[..., None], padding, log_probs)
+
+        candidates = scores[..., None] + log_probs
+        scores, index = candidates.view(batch_size, -1).topk(beam_size, dim=1)
+        beams, tokens = index // vocab_size, index % vocab_size
+
+        # Follow the surviving hypotheses
+        history = predictions.gather(1, beams[..., None].expand(-1, -1, i))
+        predictions = torch.cat([history, tokens[..., None]], dim=2)
+        lengths = lengths.gather(1, beams)
+        finished = finished.gather(1, beams)
+        state = reorder_state(state, (offsets + beams).view(-1))
+
+        stopped = (tokens == vocabulary.stop_index) & ~finished
+        lengths[stopped] = i + 1
+        finished |= stopped
+        if finished.all():
+            break
+
+        x = tokens.view(-1, 1)
+
+    # Rank by length-normalised score
+    normalised = scores / lengths.float() ** length_penalty
+    order = normalised.argsort(dim=1, descending=True)[:, :n_best]
+
+    predictions = predictions.gather(
+        1, order[..., None].expand(-1, -1, predictions.size(2))
+    )
+    return predictions, lengths.gather(1, order), scores.gather(1, order)
@@ -1,71 +1,165 @@
-import torch
-
-
-def alignment_loss(output, target, criterion, penalty):
-    """
-    Args:
-        outputs: (output_len, vocab_size) tensor of logits
-        targets: (target_len) tensor of target indices
-    """
-    output_len = output.size(0)
-    target_len = target.size(0)
-
-    # Initialize score matrix
-    M = torch.zeros(output_len + 1, target_len + 1, device=output.device)
-
-    # Initialize first row and column (penalty for skips)
-    for i in range(output_len + 1):
-        M[i, 0] = i * penalty
-    for j in range(target_len + 1):
-        M[0, j] = j * penalty
-
-    # Fill matrix
-    for i in range(1, output_len + 1):
-        for j in range(1, target_len + 1):
-
-            # Calculate match score using cross entropy
-            score = criterion(output[i - 1].unsqueeze(0), target[j - 1].unsqueeze(0))
-
-            # Take minimum of three possible operations:
-            M[i, j] = torch.min(
-                torch.stack(
-                    [
-                        M[i - 1, j - 1] + score,  # match/mismatch
-                        M[i - 1, j] + penalty,  # skip in output
-                        M[i, j - 1] + penalty,  # skip in target
-                    ]
-                )
-            )
+from typing import Optional
 
-    # print("M[x,y]", M[output_len, target_len])
-    # print("M", M)
-
-    return M[output_len, target_len]
+import torch
+import torch.nn.functional as F
 
+# Stands in for infinity outside the DP grid, keeps soft-min gradients finite
+OUTSIDE = 1e9
 
-# Decoder forward pass using alignment loss ^^^
-def alignment_forward(self, x, hidden, stop_token, target_len):
-    outputs = []
 
-    # Set a limit for pred length
-    max_length = target_len + 10
+def softmin(costs: torch.Tensor, gamma: float) -> torch.Tensor:
+    # Hard minimum when gamma is 0, smooth approximation otherwise
+    if gamma == 0:
+        return costs.min(dim=0).values
+    return -gamma * torch.logsumexp(-costs / gamma, dim=0)
 
-    # Forward pass loop
-    for _ in range(max_length):
-        output, hidden = self.rnn(x, hidden)
 
-        # Generate output logits
-        logits = self.fc(output)
-        outputs.append(logits)
+def cost_matrix(output: torch.Tensor, target: torch.Tensor) -> torch.Tensor:
+    # Cross entropy of every (output, target) pair, (batch, output_len, target_len)
+    log_probs = output.log_softmax(dim=-1)
+    return -log_probs.gather(2, target[:, None, :].expand(-1, output.size(1), -1))
 
-        # Check for stop token
-        if torch.argmax(output) == stop_token:
-            print("STOP")
-            break
 
-        # Pass output (not logits) to rnn
-        x = output
+def sweep_diagonals(
+    cost: torch.Tensor,
+    output_lengths: Optional[torch.Tensor],
+    target_lengths: Optional[torch.Tensor],
+    gamma: float,
+    penalty: Optional[float] = None,
+) -> torch.Tensor:
+    """
+    Fills the alignment DP of a batch of cost matrices along anti-diagonals
+    and returns the (batch) scores of each (output_length, target_length)
+    cell. With a penalty this is an edit distance, matches cost the pair cost
+    and skips the penalty. Without, it is DTW: every move costs the pair cost
+    and both sequences must be aligned from their first elements.
+    """
+    batch_size, output_len, target_len = cost.shape
+    device = cost.device
+
+    if output_lengths is None:
+        output_lengths = torch.full((batch_size,), output_len, device=device)
+    if target_lengths is None:
+        target_lengths = torch.full((batch_size,), target_len, device=device)
+
+    # Rows and columns of the DP start from 1
+    cost = F.pad(cost, (1, 0, 1, 0))
+
+    # Diagonal d holds the cells (i, d - i), indexed by i
+    rows = torch.arange(output_len + 1, device=device)
+    outside = torch.full((batch_size, 1), OUTSIDE, device=device)
+    diagonals = []
+    for d in range(output_len + target_len + 1):
+        cols = d - rows
+        inside = (cols >= 0) & (cols <= target_len)
+        border = inside & ((rows == 0) | (cols == 0))
+
+        if d < 2:
+            diagonal = torch.full((batch_size, output_len + 1), OUTSIDE, device=device)
+        else:
+            # (i - 1, j - 1) and (i - 1, j) sit one row up on earlier diagonals
+            up_left = torch.cat([outside, diagonals[-2][:, :-1]], dim=1)
+            up = torch.cat([outside, diagonals[-1][:, :-1]], dim=1)
+            left = diagonals[-1]
+            pair_cost = cost[:, rows, cols.clamp(0, target_len)]
+
+            if penalty is None:
+                costs = torch.stack([up_left, up, left])
+                diagonal = softmin(costs, gamma) + pair_cost
+            else:
+                costs = torch.stack([up_left + pair_cost, up + penalty, left + penalty])
+                diagonal = softmin(costs, gamma)
+
+        # Edit distances skip every element up to the borders, DTW cannot
+        if penalty is None:
+            diagonal = torch.where(border, 0.0 if d == 0 else OUTSIDE, diagonal)
+        else:
+            diagonal = torch.where(border, d * penalty, diagonal)
+        diagonal = torch.where(inside, diagonal, OUTSIDE)
+        diagonals.append(diagonal)
+
+    scores = torch.stack(diagonals)
+    return scores[
+        output_lengths + target_lengths, torch.arange(batch_size), output_lengths
+    ]
+
+
+def reduce(losses: torch.Tensor, reduction: str) -> torch.Tensor:
+    if reduction == "mean":
+        return losses.mean()
+    if reduction == "sum":
+        return losses.sum()
+    return losses
+
+
+def alignment_loss(
+    output: torch.Tensor,
+    target: torch.Tensor,
+    penalty: float,
+    output_lengths: Optional[torch.Tensor] = None,
+    target_lengths: Optional[torch.Tensor] = None,
+    gamma: float = 0.0,
+    reduction: str = "mean",
+) -> torch.Tensor:
+    """
+    Edit distance between output logits and target indices, where matching
+    output i with target j costs their cross entropy and skipping either
+    costs `penalty`. The DP runs along anti-diagonals for the whole batch,
+    gamma > 0 swaps the min for a differentiable soft-min.
 
-    # Return logits (pred_len, vocab_size)
-    outputs = torch.stack(outputs, dim=0)
-    return outputs
+    Args:
+        output: (batch, output_len, vocab_size) tensor of logits
+        target: (batch, target_len) tensor of target indices
+        output_lengths, target_lengths: (batch) real lengths, padded
+            positions are never reached. Default to the full lengths
+        reduction: "mean", "sum" or "none"
+    """
+    losses = sweep_diagonals(
+        cost_matrix(output, target), output_lengths, target_lengths, gamma, penalty
+    )
+    return reduce(losses, reduction)
+
+
+def soft_dtw_loss(
+    output: torch.Tensor,
+    target: torch.Tensor,
+    output_lengths: Optional[torch.Tensor] = None,
+    target_lengths: Optional[torch.Tensor] = None,
+    gamma: float = 0.1,
+    reduction: str = "mean",
+) -> torch.Tensor:
+    """
+    Soft-DTW between output logits and target indices with cross entropy as
+    the local cost, an output may cover several target phonemes and a target
+    phoneme several outputs. Other arguments as in `alignment_loss`.
+    """
+    losses = sweep_diagonals(
+        cost_matrix(output, target), output_lengths, target_lengths, gamma
+    )
+    return reduce(losses, reduction)
+
+
+def ctc_loss(
+    output: torch.Tensor,
+    target: torch.Tensor,
+    target_lengths: torch.Tensor,
+    blank: int,
+    output_lengths: Optional[torch.Tensor] = None,
+) -> torch.Tensor:
+    """
+    CTC over (batch, output_len, vocab_size) logits. `blank` must be a token
+    that never appears in the targets, e.g. <PAD>.
+    """
+    batch_size, output_len, _ = output.shape
+    if output_lengths is None:
+        output_lengths = torch.full((batch_size,), output_len, dtype=torch.long)
+
+    log_probs = output.log_softmax(dim=-1).transpose(0, 1)
+    return F.ctc_loss(
+        log_probs,
+        target,
+        output_lengths,
+        target_lengths,
+        blank=blank,
+        zero_infinity=True,
+    )
@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import seaborn as sns
 
+from .utils.models import parse_model_name
 from .utils.paths import get_figures_dir
 
 sns.set_palette("colorblind")
@@ -12,7 +13,9 @@ sns.set_palette("colorblind")
 # Plot the training and validation loss curves
 def training_curves(train_losses: list, valid_losses: list, model: str, n_epochs: int):
     # Extract parameters from the model name
-    h, l, d, t, r = [p[1:] for p in model.split("_")[1:]]
+    p = parse_model_name(model)
+    h, l, d = p["hidden_size"], p["num_layers"], p["dropout"]
+    t, r = p["tf_ratio"], p["learning_rate"]
 
     plt.figure(figsize=(10, 6))
     sns.lineplot(x=range(1, n_epochs + 1), y=train_losses, label="Training")
@@ -187,7 +190,9 @@ def plot_errors_by_position(ax, df):
 # Function to combine all plots into one figure
 def error_plots(df: pd.DataFrame, model: str, epoch: str) -> None:
     # Parse model parameters for title
-    e, h, l, d, t, r = [p[1:] for p in model.split("_")]
+    p = parse_model_name(model)
+    h, l, d = p["hidden_size"], p["num_layers"], p["dropout"]
+    t, r = p["tf_ratio"], p["learning_rate"]
     title = f"Model: E={epoch} H={h}, L={l}, D={d}, TF={t}, LR={r}"
 
     fig, axes = plt.subplots(2, 2, figsize=(20, 12))
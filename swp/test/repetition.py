@@ -2,26 +2,77 @@ import torch
 import torch.nn as nn
 
 from ..datasets.phonemes import Phonemes
+from ..datasets.vocabulary import STOP, Vocabulary
 from ..models.decoders import DecoderLSTM, DecoderRNN
 from ..models.encoders import EncoderLSTM, EncoderRNN
-from ..plots import confusion_matrix, error_plots
-from ..utils.models import load_weigths
+from ..models.inference import beam_search, ctc_collapse, greedy_decode, quantize
+from ..models.inference import unpad
+from ..utils.models import load_weigths, parse_model_name
 from ..utils.paths import get_weights_dir
 from .core import calculate_errors
 
 
-def test_repetition(P: Phonemes, model: str, device) -> list:
+def repeat(
+    encoder,
+    decoder,
+    vocabulary: Vocabulary,
+    inputs,
+    lengths,
+    beam_size: int = 1,
+    ctc: bool = False,
+) -> list[list[int]]:
+    # Free-running decoding, predictions can be shorter or longer
+    hidden, cell = encoder(inputs, lengths)
+    max_length = 2 * int(lengths.max()) + 1
+    if beam_size > 1:
+        predictions, prediction_lengths, _ = beam_search(
+            decoder, (hidden, cell), vocabulary, beam_size, max_length
+        )
+        predictions = predictions[:, 0]
+        prediction_lengths = prediction_lengths[:, 0]
+    else:
+        predictions, prediction_lengths = greedy_decode(
+            decoder, (hidden, cell), vocabulary, max_length
+        )
+    # CTC outputs hold <PAD> blanks and repeated phonemes
+    if ctc:
+        predictions, prediction_lengths = ctc_collapse(
+            predictions, prediction_lengths, vocabulary.pad_index
+        )
+    return unpad(predictions, prediction_lengths)
+
+
+def test_repetition(
+    P: Phonemes, model: str, device, beam_size: int = 1, quantized: bool = False
+) -> list:
+    from ..plots import confusion_matrix, error_plots
+
     print(f"\nTesting model: {model}")
+    if quantized and torch.device(device).type != "cpu":
+        raise ValueError("Quantized inference only runs on CPU")
     # Unpack parameters from model name
-    e, h, l, d, t, r = [p[1:] for p in model.split("_")]
-    print(f"Parameters: e={e} h={h} l={l} d={d} t={t} l={r}")
-    n_epochs, h_size, n_layers, dropout = int(e), int(h), int(l), float(d)
+    params = parse_model_name(model)
+    print(f"Parameters: {params}")
+    n_epochs, h_size = params["num_epochs"], params["hidden_size"]
+    n_layers, dropout = params["num_layers"], params["dropout"]
+    ctc = params["loss"] == "ctc"
 
     # Unpack variables from Phonemes class
     test_data = P.test_data
     vocab_size = P.vocab_size
     index_to_phone = P.index_to_phone
     test_dataloader = P.test_dataloader
+    vocabulary = P.vocabulary
+
+    # Refuse to evaluate weights trained with different phoneme indices
+    vocabulary_path = get_weights_dir() / model / "vocabulary.json"
+    if vocabulary_path.exists():
+        if Vocabulary.load(vocabulary_path) != P.vocabulary:
+            raise ValueError(
+                f"Model {model} was trained with a different phoneme vocabulary"
+            )
+    else:
+        print(f"No vocabulary saved for {model}, assuming the current one")
 
     # Sort index_to_phone alphabetically
     index_to_phone = {
@@ -76,38 +127,63 @@ def test_repetition(P: Phonemes, model: str, device) -> list:
 
         encoder.eval()
         decoder.eval()
+        if quantized:
+            int8_encoder, int8_decoder = quantize(encoder, decoder)
+            drift = {"changed": 0, "fp32": 0, "int8": 0}
+
         with torch.no_grad():
-            for inputs, target in test_dataloader:
+            for inputs, targets, lengths in test_dataloader:
                 inputs = inputs.to(device)
-                target = target.to(device)
-
-                hidden, cell = encoder(inputs)
-                start = torch.zeros(1, 1, dtype=int, device=device)
-                output = decoder(start, hidden, cell, target, 0)
-
-                output = torch.argmax(output, dim=2)
-                output = output.squeeze().cpu().tolist()
-                target = target.squeeze().cpu().tolist()
-
-                # Calculate errors TODO: Refactor this
-                errors = calculate_errors(output, target)
-                deletions.append(errors["dels"])
-                insertions.append(errors["inss"])
-                substitutions.append(errors["subs"])
-                edit_distances.append(errors["total"])
-                error_indices.append(errors["indices"])
-                sequence_lengths.append(errors["length"])
-
-                # Convert indices to phonemes
-                output = [index_to_phone[i] for i in output]
-                target = [index_to_phone[i] for i in target]
-
-                # Tabulate confusion between output and target
-                if len(target) == len(output):
-                    for t, p in zip(target, output):
-                        confusions[t][p] += 1
-
-                outputs.append(output[:-1])
+                targets = unpad(targets, lengths)
+                predictions = repeat(
+                    encoder, decoder, vocabulary, inputs, lengths, beam_size, ctc
+                )
+
+                # Score the int8 predictions, keeping track of the fp32 ones
+                if quantized:
+                    fp32_predictions = predictions
+                    predictions = repeat(
+                        int8_encoder,
+                        int8_decoder,
+                        vocabulary,
+                        inputs,
+                        lengths,
+                        beam_size,
+                        ctc,
+                    )
+                    for p, q, t in zip(fp32_predictions, predictions, targets):
+                        drift["changed"] += p != q
+                        drift["fp32"] += p == t
+                        drift["int8"] += q == t
+
+                for output, target in zip(predictions, targets):
+                    # Calculate errors TODO: Refactor this
+                    errors = calculate_errors(output, target)
+                    deletions.append(errors["dels"])
+                    insertions.append(errors["inss"])
+                    substitutions.append(errors["subs"])
+                    edit_distances.append(errors["total"])
+                    error_indices.append(errors["indices"])
+                    sequence_lengths.append(errors["length"])
+
+                    # Convert indices to phonemes
+                    output = [index_to_phone[i] for i in output]
+                    target = [index_to_phone[i] for i in target]
+
+                    # Tabulate confusion between output and target
+                    if len(target) == len(output):
+                        for t, p in zip(target, output):
+                            confusions[t][p] += 1
+
+                    if output and output[-1] == STOP:
+                        output = output[:-1]
+                    outputs.append(output)
+
+        if quantized:
+            n_words = len(outputs)
+            print(f"Int8 predictions differing from fp32: {drift['changed']}")
+            print(f"Word accuracy fp32: {drift['fp32'] / n_words:.4f}")
+            print(f"Word accuracy int8: {drift['int8'] / n_words:.4f}")
 
         test_data["Prediction"] = outputs
         test_data["Deletions"] = deletions
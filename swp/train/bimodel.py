@@ -0,0 +1,139 @@
+import time
+from pathlib import Path
+from typing import Iterator
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+
+from ..datasets.phonemes import Phonemes
+from ..models.autoencoder import Bimodel, concat_targets
+from ..models.decoders import DecoderLSTM
+from ..models.encoders import EncoderCNN, EncoderLSTM
+from ..utils.models import save_weights
+from ..utils.paths import get_weights_dir
+from .reading import feature_dataloaders, feature_model_name
+
+
+def repeat_forever(dataloader: DataLoader) -> Iterator:
+    # Reshuffles at every pass, unlike itertools.cycle
+    while True:
+        yield from dataloader
+
+
+def mixed_batches(
+    audit_dataloader: DataLoader, visual_dataloader: DataLoader, pad_index: int
+) -> Iterator[tuple]:
+    """
+    Pairs every phoneme batch with an image batch into one mixed batch of
+    (phonemes, lengths, codes, target), phoneme targets first. The phoneme
+    loader sets the length of an epoch, image batches are cycled.
+    """
+    images = repeat_forever(visual_dataloader)
+    for phonemes, audit_target, lengths in audit_dataloader:
+        codes, visual_target = next(images)
+        target = concat_targets([audit_target, visual_target], pad_index)
+        yield phonemes, lengths, codes, target
+
+
+def train_bimodel(P: Phonemes, image_root: Path, params: dict, device) -> str:
+    # Unpack variables
+    vocab_size = P.vocab_size
+    vocabulary = P.vocabulary
+    start_token = vocabulary.sos_index
+    pad_index = vocabulary.pad_index
+
+    # Unpack hyperparameters
+    num_epochs = params["num_epochs"]
+    batch_size = params["batch_size"]
+    hidden_size = params["hidden_size"]
+    num_layers = params["num_layers"]
+    dropout = params["dropout"]
+    tf_ratio = params["tf_ratio"]
+    learning_rate = params["learning_rate"]
+    cornet_model = params.get("cornet_model", "S")
+
+    print(f"\nTraining repetition and reading model with hyperparameters:")
+    print(f"Epochs:    {num_epochs}")
+    print(f"Batch:     {batch_size}")
+    print(f"Hidden:    {hidden_size}")
+    print(f"Layers:    {num_layers}")
+    print(f"Dropout:   {dropout}")
+    print(f"Teacher:   {tf_ratio}")
+    print(f"Learning:  {learning_rate}")
+    print(f"CORnet:    {cornet_model}")
+
+    # Same image split as the reading model
+    train_visual, valid_visual = feature_dataloaders(
+        P, image_root, cornet_model, batch_size, device
+    )
+
+    # Initialize model
+    model = feature_model_name(params)
+    model_weights_dir = get_weights_dir() / "bimodel" / model
+    model_weights_dir.mkdir(parents=True, exist_ok=True)
+    vocabulary.save(model_weights_dir / "vocabulary.json")
+
+    embedding = nn.Embedding(vocab_size, hidden_size)
+    audit_encoder = EncoderLSTM(vocab_size, hidden_size, num_layers, dropout, embedding)
+    visual_encoder = EncoderCNN(hidden_size, cornet_model, backbone=False)
+    decoder = DecoderLSTM(hidden_size, vocab_size, num_layers, dropout, embedding)
+    bimodel = Bimodel(audit_encoder, visual_encoder, decoder, start_token).to(device)
+
+    # Without backbone, every remaining parameter is trained
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_index)
+    optimizer = optim.Adam(bimodel.parameters(), lr=learning_rate)
+
+    def forward(phonemes, lengths, codes, target, tf_ratio):
+        output = bimodel(
+            target.to(device),
+            tf_ratio,
+            phonemes=phonemes.to(device),
+            lengths=lengths,
+            images=codes.to(device),
+            features=True,
+        )
+        return criterion(output.view(-1, vocab_size), target.to(device).view(-1))
+
+    for epoch in range(1, num_epochs + 1):
+        epoch_start = time.time()
+        print(f"\nEpoch {epoch}")
+
+        """ TRAINING LOOP """
+        bimodel.train()
+        train_loss = 0
+        batches = mixed_batches(P.train_dataloader, train_visual, pad_index)
+
+        for i, batch in enumerate(batches, 1):
+            print(f"{i}/{len(P.train_dataloader)}", end="\r")
+
+            optimizer.zero_grad()
+            loss = forward(*batch, tf_ratio)
+            train_loss += loss.item()
+            loss.backward()
+            optimizer.step()
+
+        print(f"Train loss: {train_loss / len(P.train_dataloader):.3f}")
+
+        """ VALIDATION LOOP """
+        bimodel.eval()
+        valid_loss = 0
+        batches = mixed_batches(P.valid_dataloader, valid_visual, pad_index)
+
+        with torch.no_grad():
+            for batch in batches:
+                valid_loss += forward(*batch, 0).item()
+
+        print(f"Valid loss: {valid_loss / len(P.valid_dataloader):.3f}")
+
+        epoch_time = time.time() - epoch_start
+        print(f"Epoch time: {epoch_time // 3600:.0f}h {epoch_time % 3600 // 60:.0f}m")
+
+        # The auditory path is saved like a repetition model
+        save_weights(model_weights_dir, embedding, audit_encoder, decoder, epoch)
+        torch.save(
+            visual_encoder.state_dict(), model_weights_dir / f"visual{epoch}.pth"
+        )
+
+    return model
@@ -0,0 +1,172 @@
+import time
+from functools import partial
+from pathlib import Path
+
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader, random_split
+
+from ..datasets.features import FeatureDataset, FeatureStore, feature_collate
+from ..datasets.features import image_ids, write_features
+from ..datasets.graphemes import RepetitionDataset
+from ..datasets.phonemes import Phonemes
+from ..models.autoencoder import Unimodel
+from ..models.decoders import DecoderLSTM
+from ..models.encoders import EncoderCNN, cornet_features
+from ..utils.models import save_weights
+from ..utils.paths import get_features_dir, get_weights_dir
+
+# ImageNet statistics CORnet was trained with
+IMAGE_MEAN = [0.485, 0.456, 0.406]
+IMAGE_STD = [0.229, 0.224, 0.225]
+
+
+def image_transform():
+    from torchvision import transforms
+
+    return transforms.Compose(
+        [transforms.ToTensor(), transforms.Normalize(IMAGE_MEAN, IMAGE_STD)]
+    )
+
+
+def get_feature_store(
+    dataset: RepetitionDataset, cornet_model: str, device, batch_size: int = 64
+) -> FeatureStore:
+    # The frozen backbone only ever sees each image once
+    directory = get_features_dir() / f"{Path(dataset.root).name}_{cornet_model.lower()}"
+    if not FeatureStore.is_valid(directory, image_ids(dataset), cornet_model):
+        print(f"Computing CORnet-{cornet_model.upper()} features of {dataset.root}")
+        cnn = cornet_features(cornet_model)
+        write_features(cnn, dataset, directory, cornet_model, batch_size, device)
+    return FeatureStore(directory)
+
+
+def feature_dataloaders(
+    P: Phonemes, image_root: Path, cornet_model: str, batch_size: int, device
+) -> tuple[DataLoader, DataLoader]:
+    """
+    Train and validation loaders of (features, target) batches over a seeded
+    90/10 split of the images in `image_root`, shared by reading and bimodel.
+    """
+    # Targets come from the image folder, features from the cache
+    images = RepetitionDataset(image_root, P.phone_to_index, image_transform())
+    store = get_feature_store(images, cornet_model, device, batch_size)
+    targets = [images.class_to_phonemes[c].long() for c in images.targets]
+    train_data, valid_data = random_split(
+        FeatureDataset(store, targets),
+        [0.9, 0.1],
+        generator=torch.Generator().manual_seed(42),
+    )
+    # Targets are only padded to 10 phonemes, longer words need the collate
+    collate_fn = partial(feature_collate, pad_index=P.pad_index)
+    train_dataloader = DataLoader(
+        train_data, batch_size=batch_size, shuffle=True, collate_fn=collate_fn
+    )
+    valid_dataloader = DataLoader(
+        valid_data, batch_size=batch_size, collate_fn=collate_fn
+    )
+    return train_dataloader, valid_dataloader
+
+
+def feature_model_name(params: dict) -> str:
+    # Weights directory name of reading and bimodel models
+    model = f"e{params['num_epochs']}_h{params['hidden_size']}"
+    model += f"_l{params['num_layers']}_d{params['dropout']}"
+    model += f"_t{params['tf_ratio']}_r{params['learning_rate']}"
+    return model
+
+
+def train_reading(P: Phonemes, image_root: Path, params: dict, device) -> str:
+    # Unpack variables
+    vocab_size = P.vocab_size
+    vocabulary = P.vocabulary
+    start_token = vocabulary.sos_index
+    pad_index = vocabulary.pad_index
+
+    # Unpack hyperparameters
+    num_epochs = params["num_epochs"]
+    batch_size = params["batch_size"]
+    hidden_size = params["hidden_size"]
+    num_layers = params["num_layers"]
+    dropout = params["dropout"]
+    tf_ratio = params["tf_ratio"]
+    learning_rate = params["learning_rate"]
+    cornet_model = params.get("cornet_model", "S")
+
+    print(f"\nTraining reading model with hyperparameters:")
+    print(f"Epochs:    {num_epochs}")
+    print(f"Batch:     {batch_size}")
+    print(f"Hidden:    {hidden_size}")
+    print(f"Layers:    {num_layers}")
+    print(f"Dropout:   {dropout}")
+    print(f"Teacher:   {tf_ratio}")
+    print(f"Learning:  {learning_rate}")
+    print(f"CORnet:    {cornet_model}")
+
+    train_dataloader, valid_dataloader = feature_dataloaders(
+        P, image_root, cornet_model, batch_size, device
+    )
+
+    # Initialize model
+    model = feature_model_name(params)
+    model_weights_dir = get_weights_dir() / "reading" / model
+    model_weights_dir.mkdir(parents=True, exist_ok=True)
+    vocabulary.save(model_weights_dir / "vocabulary.json")
+
+    embedding = nn.Embedding(vocab_size, hidden_size)
+    encoder = EncoderCNN(hidden_size, cornet_model, backbone=False).to(device)
+    decoder = DecoderLSTM(hidden_size, vocab_size, num_layers, dropout, embedding).to(
+        device
+    )
+
+    # Only the projection to the hidden state and the decoder are trained
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_index)
+    parameters = list(encoder.to_hidden.parameters()) + list(decoder.parameters())
+    optimizer = optim.Adam(parameters, lr=learning_rate)
+
+    reader = Unimodel(encoder, decoder, start_token)
+
+    def forward(code, target, tf_ratio):
+        output = reader(code, target, tf_ratio, features=True)
+        return criterion(output.view(-1, vocab_size), target.view(-1))
+
+    for epoch in range(1, num_epochs + 1):
+        epoch_start = time.time()
+        print(f"\nEpoch {epoch}")
+
+        """ TRAINING LOOP """
+        reader.train()
+        train_loss = 0
+
+        for i, (code, target) in enumerate(train_dataloader, 1):
+            print(f"{i}/{len(train_dataloader)}", end="\r")
+            code = code.to(device)
+            target = target.to(device)
+
+            optimizer.zero_grad()
+            loss = forward(code, target, tf_ratio)
+            train_loss += loss.item()
+            loss.backward()
+            optimizer.step()
+
+        print(f"Train loss: {train_loss / len(train_dataloader):.3f}")
+
+        """ VALIDATION LOOP """
+        reader.eval()
+        valid_loss = 0
+
+        with torch.no_grad():
+            for code, target in valid_dataloader:
+                code = code.to(device)
+                target = target.to(device)
+                valid_loss += forward(code, target, 0).item()
+
+        print(f"Valid loss: {valid_loss / len(valid_dataloader):.3f}")
+
+        epoch_time = time.time() - epoch_start
+        print(f"Epoch time: {epoch_time // 3600:.0f}h {epoch_time % 3600 // 60:.0f}m")
+
+        save_weights(model_weights_dir, embedding, encoder, decoder, epoch)
+
+    return model
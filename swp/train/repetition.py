@@ -1,3 +1,4 @@
+import math
 import time
 
 import torch
@@ -7,22 +8,57 @@ import torch.optim as optim
 from ..datasets.phonemes import Phonemes
 from ..models.decoders import DecoderLSTM, DecoderRNN
 from ..models.encoders import EncoderLSTM, EncoderRNN
-from ..plots import training_curves
+from ..models.losses import ctc_loss, soft_dtw_loss
 from ..utils.grid_search import grid_search_log
-from ..utils.models import save_weights
+from ..utils.models import model_name, save_weights
 from ..utils.paths import get_weights_dir
 from ..utils.perf import Timer
 
 
+LOSSES = ("ce", "ctc", "sdtw")
+TF_SCHEDULES = ("constant", "linear", "exponential", "inverse_sigmoid")
+
+# Decay used by each schedule when none is given, constant and linear ignore it
+TF_DECAYS = {
+    "constant": 1.0,
+    "linear": 1.0,
+    "exponential": 0.9,
+    "inverse_sigmoid": 10.0,
+}
+
+
+def teacher_forcing_schedule(
+    tf_ratio: float, epoch: int, num_epochs: int, schedule: str, decay: float
+) -> float:
+    """
+    Teacher forcing ratio for a (1-indexed) epoch. Linear decays to 0 over
+    the run, exponential multiplies by `decay` each epoch and inverse sigmoid
+    uses `decay` as its k (k >= 1, larger k decays more slowly).
+    """
+    step = epoch - 1
+    if schedule == "constant":
+        return tf_ratio
+    if schedule == "linear":
+        return tf_ratio * (1 - step / max(1, num_epochs - 1))
+    if schedule == "exponential":
+        return tf_ratio * decay**step
+    if schedule == "inverse_sigmoid":
+        return tf_ratio * decay / (decay + math.exp(step / decay))
+    raise ValueError(
+        f"Unknown teacher forcing schedule {schedule}, expected one of {TF_SCHEDULES}"
+    )
+
+
 def train_repetition(P: Phonemes, params: dict, device):
     # Unpack variables
     vocab_size = P.vocab_size
-    index_to_phone = P.index_to_phone
-    phone_to_index = P.phone_to_index
+    vocabulary = P.vocabulary
     train_dataloader = P.train_dataloader
     valid_dataloader = P.valid_dataloader
 
-    start_token = phone_to_index["<SOS>"]
+    start_token = vocabulary.sos_index
+    stop_index = vocabulary.stop_index
+    pad_index = vocabulary.pad_index
 
     # Unpack hyperparameters
     num_epochs = params["num_epochs"]
@@ -31,22 +67,43 @@ def train_repetition(P: Phonemes, params: dict, device):
     num_layers = params["num_layers"]
     dropout = params["dropout"]
     tf_ratio = params["tf_ratio"]
+    tf_schedule = params.get("tf_schedule", "constant")
+    tf_decay = params.get("tf_decay")
+    if tf_schedule not in TF_SCHEDULES:
+        raise ValueError(
+            f"Unknown teacher forcing schedule {tf_schedule}, "
+            f"expected one of {TF_SCHEDULES}"
+        )
+    if tf_decay is None:
+        tf_decay = TF_DECAYS[tf_schedule]
+    if tf_schedule == "inverse_sigmoid" and tf_decay < 1:
+        raise ValueError(f"The inverse sigmoid schedule needs k >= 1, got {tf_decay}")
+    loss_name = params.get("loss", "ce")
+    sdtw_gamma = params.get("sdtw_gamma", 0.1)
+    if loss_name not in LOSSES:
+        raise ValueError(f"Unknown loss {loss_name}, expected one of {LOSSES}")
     learning_rate = params["learning_rate"]
 
     print(f"\nTraining model with hyperparameters:")
     print(f"Epochs:    {num_epochs}")
+    print(f"Batch:     {batch_size}")
     print(f"Hidden:    {hidden_size}")
     print(f"Layers:    {num_layers}")
     print(f"Dropout:   {dropout}")
-    print(f"Teacher:   {tf_ratio}")
+    print(f"Teacher:   {tf_ratio} ({tf_schedule}, {tf_decay})")
     print(f"Learning:  {learning_rate}")
+    print(f"Loss:      {loss_name}")
 
     # Initialize model
-    model = f"e{num_epochs}_h{hidden_size}_l{num_layers}"
-    model += f"_d{dropout}_t{tf_ratio}_r{learning_rate}"
+    model = model_name(
+        {**params, "tf_schedule": tf_schedule, "tf_decay": tf_decay, "loss": loss_name}
+    )
     model_weights_dir = get_weights_dir() / model
     model_weights_dir.mkdir(exist_ok=True)
 
+    # Checkpoints are only meaningful with the indices they were trained on
+    vocabulary.save(model_weights_dir / "vocabulary.json")
+
     embedding = nn.Embedding(vocab_size, hidden_size)
 
     # encoder = EncoderRNN(vocab_size, hidden_size, num_layers, dropout, embedding).to(
@@ -65,7 +122,8 @@ def train_repetition(P: Phonemes, params: dict, device):
         device
     )
 
-    criterion = nn.CrossEntropyLoss()
+    # Padding positions are masked out of the loss
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_index)
     parameters = (
         list(embedding.parameters())
         + list(encoder.lstm.parameters())
@@ -73,15 +131,45 @@ def train_repetition(P: Phonemes, params: dict, device):
     )
     optimizer = optim.Adam(parameters, lr=learning_rate)
 
+    def forward(input, target, lengths, tf_ratio):
+        start = torch.full((input.size(0), 1), start_token, device=device)
+        # hidden = encoder(input, lengths)
+        # output = decoder(start, hidden, target, tf_ratio)
+        hidden, cell = encoder(input, lengths)
+
+        if loss_name == "ce":
+            output = decoder(start, hidden, cell, target, tf_ratio)
+            return output, criterion(output.view(-1, vocab_size), target.view(-1))
+
+        # Length-flexible objectives score free-running outputs
+        output_length = 2 * target.size(1) + 1
+        output = decoder.free_running(start, hidden, cell, output_length)
+        if loss_name == "ctc":
+            # <PAD> never appears in targets and doubles as the CTC blank
+            return output, ctc_loss(output, target, lengths, pad_index)
+
+        # Each output ends with its first <STOP>, or runs to the maximum length
+        stops = output.argmax(dim=2) == stop_index
+        output_lengths = torch.where(
+            stops.any(dim=1), stops.int().argmax(dim=1) + 1, output_length
+        )
+        lengths = lengths.to(device)
+        loss = soft_dtw_loss(output, target, output_lengths, lengths, sdtw_gamma)
+        return output, loss
+
     timer = Timer()
     train_losses = []
     valid_losses = []
     epoch_times = []
     error_count = 0
+    checkpoint_every = max(1, len(train_dataloader) // 10)
 
     for epoch in range(1, num_epochs + 1):
         epoch_start = time.time()
         print(f"\nEpoch {epoch}")
+        epoch_tf_ratio = teacher_forcing_schedule(
+            tf_ratio, epoch, num_epochs, tf_schedule, tf_decay
+        )
 
         """ TRAINING LOOP """
         encoder.train()
@@ -89,7 +177,7 @@ def train_repetition(P: Phonemes, params: dict, device):
         train_loss = 0
         checkpoint = 1
 
-        for i, (input, target) in enumerate(train_dataloader, 1):
+        for i, (input, target, lengths) in enumerate(train_dataloader, 1):
             print(f"{i}/{len(train_dataloader)}", end="\r")
             timer.start()
 
@@ -97,30 +185,15 @@ def train_repetition(P: Phonemes, params: dict, device):
             target = target.to(device)
             optimizer.zero_grad()
 
-            # Forward pass
-            start = torch.zeros(batch_size, 1, dtype=int, device=device)
-            # start = torch.ones(batch_size, 1, dtype=int, device=device) * start_token
-
-            # hidden = encoder(input)
-            # output = decoder(start, hidden, target, tf_ratio)
-            hidden, cell = encoder(input)
-            output = decoder(start, hidden, cell, target, tf_ratio)
-
-            # Loss computation
-            output = output.view(-1, vocab_size)
-            target = target.view(-1)
-            loss = criterion(output, target)
+            # Forward pass and loss computation
+            output, loss = forward(input, target, lengths, epoch_tf_ratio)
             train_loss += loss.item()
 
-            if epoch == num_epochs:
-                p = torch.argmax(output, dim=1)
-                p = p.squeeze().tolist()
-                t = target.squeeze().tolist()
-                if p != t:
-                    error_count += 1
-                    # p = [index_to_phone[i] for i in p]
-                    # t = [index_to_phone[i] for i in t]
-                    # errors.append((p, t))
+            # Count words with at least one error outside of the padding
+            if epoch == num_epochs and loss_name == "ce":
+                mask = target != pad_index
+                p = torch.argmax(output, dim=2)
+                error_count += ((p != target) & mask).any(dim=1).sum().item()
 
             # Backward pass
             timer.start()
@@ -128,11 +201,7 @@ def train_repetition(P: Phonemes, params: dict, device):
             optimizer.step()
             timer.stop("Train step")
 
-            if (
-                epoch == 1
-                and checkpoint != 10
-                and i % ((len(train_dataloader) // 10)) == 0
-            ):
+            if epoch == 1 and checkpoint != 10 and i % checkpoint_every == 0:
                 save_weights(
                     model_weights_dir,
                     embedding,
@@ -154,22 +223,14 @@ def train_repetition(P: Phonemes, params: dict, device):
         valid_loss = 0
 
         with torch.no_grad():
-            for i, (input, target) in enumerate(valid_dataloader, 1):
+            for i, (input, target, lengths) in enumerate(valid_dataloader, 1):
                 print(f"{i+1}/{len(valid_dataloader)}", end="\r")
 
                 input = input.to(device)
                 target = target.to(device)
 
-                # Forward passes
-                start = torch.zeros(batch_size, 1, dtype=int, device=device)
-
-                hidden, cell = encoder(input)
-                output = decoder(start, hidden, cell, target, 0)
-
-                # Loss computation
-                output = output.view(-1, vocab_size)
-                target = target.view(-1)
-                loss = criterion(output, target)
+                # Forward pass and loss computation
+                _, loss = forward(input, target, lengths, 0)
                 valid_loss += loss.item()
 
         valid_loss /= len(valid_dataloader)
@@ -181,17 +242,22 @@ def train_repetition(P: Phonemes, params: dict, device):
         print(f"Epoch time: {epoch_time // 3600:.0f}h {epoch_time % 3600 // 60:.0f}m")
 
         # Save model weights for every epoch
-        save_weights(model_weights_dir, shared_embedding, encoder, decoder, epoch)
+        save_weights(model_weights_dir, embedding, encoder, decoder, epoch)
 
     # Plot loss curves and create gridsearch log
+    from ..plots import training_curves
+
     training_curves(train_losses, valid_losses, model, num_epochs)
     grid_search_log(train_losses, valid_losses, model, num_epochs)
 
     # Print timing summary
     timer.summary()
 
-    # Print error summary
-    print(f"\nError rate: {error_count / len(train_dataloader):.2f}")
+    # Print error summary, positions only line up with cross entropy
+    if loss_name == "ce":
+        # Words drawn in the last epoch, not the number of unique words
+        num_words = len(train_dataloader.batch_sampler.sampler)
+        print(f"\nError rate: {error_count / num_words:.2f}")
     # for p, t in errors:
     #     print(p)
     #     print(t, "\n")
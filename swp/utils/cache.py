@@ -0,0 +1,57 @@
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from .paths import get_dataset_dir
+
+# SQLite caps the number of bound parameters per statement
+_MAX_PARAMS = 900
+
+
+def get_cache_path() -> Path:
+    cache_dir = get_dataset_dir() / "cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir / "lexicon.sqlite"
+
+
+class WordCache:
+    """
+    Persistent word -> value table stored in SQLite, values are JSON encoded.
+    Each annotation (pronunciation, part of speech, ...) gets its own table.
+    """
+
+    def __init__(self, table: str, path: Optional[Path] = None) -> None:
+        self.table = table
+        self.path = path or get_cache_path()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(word TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=60)
+
+    def get_many(self, words: Iterable[str]) -> dict[str, Any]:
+        words = list(words)
+        found = {}
+        with self._connect() as conn:
+            for i in range(0, len(words), _MAX_PARAMS):
+                chunk = words[i : i + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT word, value FROM {self.table} "
+                    f"WHERE word IN ({placeholders})",
+                    chunk,
+                )
+                found.update((word, json.loads(value)) for word, value in rows)
+        return found
+
+    def set_many(self, items: dict[str, Any]) -> None:
+        rows = [(word, json.dumps(value)) for word, value in items.items()]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (word, value) VALUES (?, ?)",
+                rows,
+            )
@@ -1,17 +1,73 @@
+import hashlib
+import json
+import os
 import random
 from ast import literal_eval
-from collections import defaultdict
+from functools import lru_cache
+from itertools import chain, islice
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence
 
 import numpy as np
 import pandas as pd
-import spacy
-import spacy.cli
-from g2p_en import G2p
-from morphemes import Morphemes
-from wordfreq import iter_wordlist, word_frequency, zipf_frequency
 
-from .paths import get_dataframe_dir, get_dataset_dir, get_folds_dir
+from .lexicon import parse_morphology, pronounce, tag_parts_of_speech
+from .ngrams import NgramCounter
+from .paths import get_dataframe_dir, get_dataset_dir
+
+
+# Number of words in the training lexicon
+LEXICON_SIZE = 50000
+# Size of the former pre-sampled training set
+TRAIN_DRAWS = 90000
+
+# Columns holding lists, stored natively as Parquet list columns
+LIST_COLUMNS = ["Phonemes", "Prefixes", "Roots", "Frequencies", "Suffixes"]
+
+
+def get_dataframe_path(name: str) -> Path:
+    return get_dataframe_dir() / f"{name}.parquet"
+
+
+def save_dataframe(dataframe: pd.DataFrame, path: Path) -> None:
+    dataframe.to_parquet(path, index=False)
+
+
+# Load a Parquet table, only reading the requested columns
+def load_dataframe(path: Path, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = list(columns) if columns is not None else None
+    table = pq.read_table(path, columns=columns)
+    dataframe = table.to_pandas()
+
+    # Arrow hands list cells back as arrays, convert them to python lists
+    for field in table.schema:
+        if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+            dataframe[field.name] = table.column(field.name).to_pylist()
+
+    return dataframe
+
+
+# Convert a dataframe from the legacy CSV format to Parquet
+def migrate_csv(name: str) -> Optional[pd.DataFrame]:
+    csv_path = get_dataframe_dir() / f"{name}.csv"
+    if not csv_path.exists():
+        return None
+
+    # Words like "null" or "nan" must not be parsed as missing values
+    dataframe = pd.read_csv(csv_path, index_col=0, converters={"Word": str})
+    for column in LIST_COLUMNS:
+        if column in dataframe:
+            dataframe[column] = [
+                literal_eval(x) if isinstance(x, str) else None
+                for x in dataframe[column]
+            ]
+    dataframe = dataframe.reset_index(drop=True)
+    save_dataframe(dataframe, get_dataframe_path(name))
+
+    return dataframe
 
 
 # Process the hand-made test datasets
@@ -33,12 +89,19 @@ def process_dataset(directory: Path, real=False) -> pd.DataFrame:
     return data
 
 
-# Get morphological data for a word
-def get_morphological_data(word: str):
-    mrp = Morphemes(
-        str(get_dataset_dir() / "morphemes_data")
-    )  # TODO check that the path is ok
-    parse = mrp.parse(word)
+MORPHOLOGY_COLUMNS = [
+    "Prefixes",
+    "Roots",
+    "Frequencies",
+    "Suffixes",
+    "Morpheme Count",
+    "Structure",
+]
+
+
+# Summarize a morphological parse into the morphology columns
+def summarize_parse(parse: dict) -> tuple:
+    from wordfreq import zipf_frequency
 
     if parse["status"] == "NOT_FOUND":
         return None, None, None, None, None, None
@@ -64,12 +127,16 @@ def get_morphological_data(word: str):
     return prefixes, roots, root_freqs, suffixes, count, structure
 
 
+# Get morphological data for a word
+def get_morphological_data(word: str):
+    return summarize_parse(parse_morphology([word], num_workers=1)[0])
+
+
 # Add frequency, part of speech, phonemes, and morphology
-def clean_and_enrich_data(df: pd.DataFrame, real=False) -> pd.DataFrame:
-    if not spacy.util.is_package("en_core_web_lg"):
-        spacy.cli.download("en_core_web_lg")
-    nlp = spacy.load("en_core_web_lg")
-    g2p = G2p()
+def clean_and_enrich_data(
+    df: pd.DataFrame, real=False, n_process: int = 1, morphology: bool = False
+) -> pd.DataFrame:
+    from wordfreq import zipf_frequency
 
     # Rename columns
     df = df.rename(
@@ -89,15 +156,17 @@ def clean_and_enrich_data(df: pd.DataFrame, real=False) -> pd.DataFrame:
             columns=["Number", "percentile freq", "morph structure"], errors="ignore"
         )
         df["Zipf Frequency"] = df["Word"].apply(lambda x: zipf_frequency(x, "en"))
-        df["Part of Speech"] = df["Word"].apply(lambda x: nlp(x)[0].pos_)
+        df["Part of Speech"] = tag_parts_of_speech(df["Word"], n_process=n_process)
 
     # Add Phonemes column
-    df["Phonemes"] = df["Word"].apply(g2p)
+    df["Phonemes"] = pronounce(df["Word"])
 
-    # NOTE: Very slow
-    # Add Morphological data
-    # columns = ["Prefixes", "Roots", "Frequencies", "Suffixes", "Morpheme Count", "Structure"]
-    # df[columns] = df['Word'].apply(lambda word: pd.Series(get_morphological_data(word)))
+    # Add Morphological data, parses are pooled and cached on disk
+    if morphology:
+        parses = parse_morphology(df["Word"])
+        summaries = zip(*[summarize_parse(parse) for parse in parses])
+        for column, values in zip(MORPHOLOGY_COLUMNS, summaries):
+            df[column] = list(values)
 
     return df
 
@@ -107,22 +176,18 @@ def create_test_data() -> pd.DataFrame:
 
     # Process real words
     handmade_real_path = get_dataset_dir() / "handmade" / "test_dataset_real"
-    csv_real_path = get_dataframe_dir() / "real_test.csv"
     real_words = process_dataset(handmade_real_path, real=True)
     real_words = clean_and_enrich_data(real_words, real=True)
-    real_words.to_csv(csv_real_path)
+    save_dataframe(real_words, get_dataframe_path("real_test"))
 
     # Process pseudo words
     handmade_pseudo_path = get_dataset_dir() / "handmade" / "test_dataset_pseudo"
-    csv_pseudo_path = get_dataframe_dir() / "pseudo_test.csv"
     pseudo_words = process_dataset(handmade_pseudo_path)
     pseudo_words = clean_and_enrich_data(pseudo_words)
-    pseudo_words.to_csv(csv_pseudo_path)
+    save_dataframe(pseudo_words, get_dataframe_path("pseudo_test"))
 
     # Combine datasets
-    dataframe = pd.concat(
-        [real_words, pseudo_words], join="outer"
-    )  # , ignore_index=True)
+    dataframe = pd.concat([real_words, pseudo_words], join="outer", ignore_index=True)
 
     # Rearrange columns
     columns = [
@@ -138,211 +203,315 @@ def create_test_data() -> pd.DataFrame:
     ]
     dataframe = dataframe.reindex(columns=columns)
 
-    csv_complete_path = get_dataframe_dir() / "complete_test.csv"
-    dataframe.to_csv(csv_complete_path)
+    save_dataframe(dataframe, get_dataframe_path("complete_test"))
 
     return dataframe
 
 
-def get_test_data(force_recreate: bool = False) -> pd.DataFrame:
-    csv_test_path = get_dataframe_dir() / "complete_test.csv"
-    if csv_test_path.exists() and not force_recreate:
-        dataframe = pd.read_csv(csv_test_path)
-        dataframe["Phonemes"] = dataframe["Phonemes"].apply(literal_eval)
-    else:
-        dataframe = create_test_data()
-    return dataframe
+def get_test_data(
+    force_recreate: bool = False, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    test_path = get_dataframe_path("complete_test")
+    if not test_path.exists() or force_recreate:
+        if force_recreate or migrate_csv("complete_test") is None:
+            create_test_data()
+    return load_dataframe(test_path, columns)
+
+
+def iter_chunks(iterable: Iterable, chunk_size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+# Frequencies of a whole chunk, rounded to 3 significant digits like wordfreq
+def chunk_frequencies(words: pd.Series) -> np.ndarray:
+    from wordfreq import get_frequency_dict
+
+    freqs = words.map(get_frequency_dict("en")).fillna(0.0).to_numpy(float)
+    nonzero = freqs > 0
+    scale = np.ones_like(freqs)
+    scale[nonzero] = 10.0 ** (np.floor(-np.log10(freqs[nonzero])) + 3)
+    return np.round(freqs * scale) / scale
+
+
+def create_train_data(
+    test_data: pd.DataFrame,
+    size: int = LEXICON_SIZE,
+    chunk_size: int = 10000,
+    n_process: int = 1,
+    morphology: bool = False,
+) -> None:
+    """
+    Streams the wordfreq list by frequency, keeps the first `size` alphabetic
+    words with a vowel that are not in the test set, and appends each enriched
+    chunk to the training table so the full lexicon is never held in memory.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from wordfreq import iter_wordlist
 
+    test_words = set(test_data["Word"])
+    train_path = get_dataframe_path("complete_train")
+    partial_path = train_path.with_suffix(".partial")
+    writer = None
+    count = 0
+
+    try:
+        for chunk in iter_chunks(iter_wordlist("en"), chunk_size):
+            words = pd.Series(chunk, dtype=object)
+
+            # Skip non-alphabetic words, words without vowels and test words
+            keep = (
+                words.str.isalpha()
+                & words.str.contains("[aeiouy]", regex=True)
+                & ~words.isin(test_words)
+            )
+            words = words[keep].iloc[: size - count]
+            if words.empty:
+                continue
+
+            dataframe = pd.DataFrame(
+                {"Word": words.to_numpy(), "Frequency": chunk_frequencies(words)}
+            )
+            dataframe = clean_and_enrich_data(
+                dataframe, real=True, n_process=n_process, morphology=morphology
+            )
+
+            # First chunk fixes the schema, later chunks are cast to it
+            if writer is None:
+                fields = [f for f in train_fields() if f.name in dataframe]
+                writer = pq.ParquetWriter(partial_path, pa.schema(fields))
+            table = pa.Table.from_pandas(
+                dataframe, schema=writer.schema, preserve_index=False
+            )
+            writer.write_table(table)
+
+            count += len(dataframe)
+            print(f"Lexicon: {count}/{size} words", end="\r")
+            if count >= size:
+                break
+
+        # No word was kept, still leave a readable (empty) table
+        if writer is None:
+            pq.write_table(pa.schema(train_fields()).empty_table(), partial_path)
+        else:
+            writer.close()
+            writer = None
+
+        # Only replace the previous table once the new one is complete
+        partial_path.replace(train_path)
+    finally:
+        if writer is not None:
+            writer.close()
+        partial_path.unlink(missing_ok=True)
+
+
+def train_fields() -> list:
+    import pyarrow as pa
+
+    return [
+        pa.field("Word", pa.string()),
+        pa.field("Frequency", pa.float64()),
+        pa.field("Zipf Frequency", pa.float64()),
+        pa.field("Part of Speech", pa.string()),
+        pa.field("Phonemes", pa.list_(pa.string())),
+        pa.field("Prefixes", pa.list_(pa.string())),
+        pa.field("Roots", pa.list_(pa.string())),
+        pa.field("Frequencies", pa.list_(pa.float64())),
+        pa.field("Suffixes", pa.list_(pa.string())),
+        pa.field("Morpheme Count", pa.float64()),
+        pa.field("Structure", pa.string()),
+    ]
 
-def create_train_data() -> pd.DataFrame:
-    word_list = []
-    freq_list = []
-    for i, word in enumerate(iter_wordlist("en")):
-        # Limit the number of words
-        if i >= 30000:
-            break
-        # Skip any non-alphabetic words
-        if not word.isalpha():
-            continue
-        # Skip any words that don't have vowels
-        if not any(char in "aeiouy" for char in word):
-            continue
 
-        word_list.append(word)
-        freq_list.append(word_frequency(word, "en"))
+def get_train_data(
+    force_recreate: bool = False, columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    train_path = get_dataframe_path("complete_train")
+    if not train_path.exists() or force_recreate:
+        if force_recreate or migrate_csv("complete_train") is None:
+            test_df = get_test_data(force_recreate, columns=["Word"])
+            create_train_data(test_df)
+    return load_dataframe(train_path, columns)
 
-    dataframe = pd.DataFrame({"Word": word_list, "Frequency": freq_list})
-    dataframe = clean_and_enrich_data(dataframe, real=True)
 
-    csv_train_path = get_dataframe_dir() / "complete_train.csv"
-    dataframe.to_csv(csv_train_path)
+def get_folds_path() -> Path:
+    return get_dataframe_dir() / "complete_train_folds.npy"
 
-    return dataframe
 
+def table_hash(train_data: pd.DataFrame) -> str:
+    digest = hashlib.sha1()
+    for word in train_data["Word"]:
+        digest.update(f"{word}\n".encode())
+    return digest.hexdigest()
 
-def get_train_data(force_recreate: bool = False) -> pd.DataFrame:
-    csv_train_path = get_dataframe_dir() / "complete_train.csv"
-    if csv_train_path.exists() and not force_recreate:
-        dataframe = pd.read_csv(csv_train_path)
-        dataframe["Phonemes"] = dataframe["Phonemes"].apply(literal_eval)
-    else:
-        dataframe = create_train_data()
-    return dataframe
+
+# Folds are only valid for the exact table and seed they were drawn from
+def folds_header(train_hash: str, seed: int, num_folds: int) -> dict:
+    return {"seed": seed, "num_folds": num_folds, "table": train_hash}
 
 
-def create_folds(train_data: pd.DataFrame, seed: int = 42, num_folds: int = 5) -> None:
-    folds_dir = get_folds_dir()
+# Assign every row of the training table to a fold, stored as a single array
+def create_folds(
+    train_data: pd.DataFrame, seed: int = 42, num_folds: int = 5
+) -> np.ndarray:
     dataset_len = len(train_data.index)
     generator = np.random.default_rng(seed=seed)
 
-    fold_ids = np.array([i % num_folds for i in range(dataset_len)])
+    fold_ids = (np.arange(dataset_len) % num_folds).astype(np.int8)
     generator.shuffle(fold_ids)
 
-    for i in range(num_folds):
-        mask: np.ndarray = fold_ids == i
-
-        ith_train_fold = train_data[np.logical_not(mask)].reset_index()
-        ith_val_fold = train_data[mask].reset_index()
-
-        csv_ith_train_fold_path = folds_dir / f"train_fold_{i}.csv"
-        csv_ith_valid_fold_path = folds_dir / f"valid_fold_{i}.csv"
-
-        ith_train_fold.to_csv(csv_ith_train_fold_path)
-        ith_val_fold.to_csv(csv_ith_valid_fold_path)
-
-
-def get_training_fold(fold_id: int, force_recreate: bool = False) -> pd.DataFrame:
-    csv_train_fold_path = get_folds_dir() / f"train_fold_{fold_id}.csv"
-    if force_recreate or not csv_train_fold_path.exists():
-        train_df = get_train_data(force_recreate)
-        create_folds(train_df)
-    dataframe = pd.read_csv(csv_train_fold_path)
-    dataframe["Phonemes"] = dataframe["Phonemes"].apply(literal_eval)
-    return dataframe
-
-
-def get_val_fold(fold_id: int, force_recreate: bool = False) -> pd.DataFrame:
-    csv_valid_fold_path = get_folds_dir() / f"valid_fold_{fold_id}.csv"
-    if force_recreate or not csv_valid_fold_path.exists():
-        train_df = get_train_data(force_recreate)
-        create_folds(train_df)
-    dataframe = pd.read_csv(csv_valid_fold_path)
-    dataframe["Phonemes"] = dataframe["Phonemes"].apply(literal_eval)
-    return dataframe
-
-
-def sample_words() -> tuple[list[list[str]], list[list[str]]]:
-    g2p = G2p()
-    total_count = 100000
-    train_valid_split = 0.9
+    # Both files are written aside and renamed into place, the header last,
+    # so concurrent jobs never see a truncated array or a stale header
+    folds_path = get_folds_path()
+    header_path = folds_path.with_suffix(".json")
+    partial_folds = folds_path.with_name(f"{folds_path.name}.{os.getpid()}.partial")
+    partial_header = header_path.with_name(f"{header_path.name}.{os.getpid()}.partial")
+    try:
+        with partial_folds.open("wb") as f:
+            np.save(f, fold_ids)
+        with partial_header.open("w") as f:
+            json.dump(folds_header(table_hash(train_data), seed, num_folds), f)
+        header_path.unlink(missing_ok=True)
+        os.replace(partial_folds, folds_path)
+        os.replace(partial_header, header_path)
+    finally:
+        partial_folds.unlink(missing_ok=True)
+        partial_header.unlink(missing_ok=True)
+    return fold_ids
+
+
+def get_fold_ids(
+    force_recreate: bool = False, seed: int = 42, num_folds: int = 5
+) -> np.ndarray:
+    folds_path = get_folds_path()
+    header_path = folds_path.with_suffix(".json")
+    train_words = get_cached_train_data(("Word",))
+    if not force_recreate and folds_path.exists() and header_path.exists():
+        with header_path.open("r") as f:
+            header = json.load(f)
+        if header == folds_header(get_cached_table_hash(), seed, num_folds):
+            return np.load(folds_path, mmap_mode="r")
+    return create_folds(train_words, seed, num_folds)
+
+
+def get_fold_indices(
+    fold_id: int, force_recreate: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    fold_ids = get_fold_ids(force_recreate)
+    train_indices = np.flatnonzero(fold_ids != fold_id)
+    valid_indices = np.flatnonzero(fold_ids == fold_id)
+    return train_indices, valid_indices
+
+
+# One in-memory copy of the training table per process, shared by all folds
+@lru_cache(maxsize=None)
+def get_cached_train_data(columns: Optional[tuple[str, ...]] = None) -> pd.DataFrame:
+    return get_train_data(columns=columns)
+
+
+# Hashed once per process, every fold checks the stored folds against it
+@lru_cache(maxsize=None)
+def get_cached_table_hash() -> str:
+    return table_hash(get_cached_train_data(("Word",)))
+
+
+def get_training_fold(
+    fold_id: int,
+    force_recreate: bool = False,
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    if force_recreate:
+        get_train_data(force_recreate)
+        get_cached_train_data.cache_clear()
+        get_cached_table_hash.cache_clear()
+    train_indices, _ = get_fold_indices(fold_id, force_recreate)
+    train_data = get_cached_train_data(tuple(columns) if columns else None)
+    return train_data.iloc[train_indices].reset_index()
+
+
+def get_val_fold(
+    fold_id: int,
+    force_recreate: bool = False,
+    columns: Optional[Sequence[str]] = None,
+) -> pd.DataFrame:
+    if force_recreate:
+        get_train_data(force_recreate)
+        get_cached_train_data.cache_clear()
+        get_cached_table_hash.cache_clear()
+    _, valid_indices = get_fold_indices(fold_id, force_recreate)
+    train_data = get_cached_train_data(tuple(columns) if columns else None)
+    return train_data.iloc[valid_indices].reset_index()
+
+
+def sample_words(
+    valid_count: int = 10000, train_draws: int = TRAIN_DRAWS
+) -> tuple[list[list[str]], list[float], list[list[str]]]:
+    """
+    Splits the unique training lexicon into training words, with their
+    frequencies, and `valid_count` held-out low frequency validation words.
+    Training words are drawn by frequency at every epoch, see `AliasSampler`.
+    Frequencies are scaled to the expected number of draws of each word in
+    `train_draws` draws, the size of the former pre-sampled training set, so
+    statistics weighted by them stay on the scale of the old counts.
+    """
     frequency_threshold = 0.9
 
-    train_df = get_train_data()
-
-    freq_list = train_df["Frequency"].tolist()
-    word_list = train_df["Word"].tolist()
-    total_freq = train_df["Frequency"].sum()
-
-    # Normalize frequencies
-    freq_array = np.array(freq_list) / total_freq
-
-    # Sort words by frequency (low to high)
-    sorted_indices = np.argsort(freq_array)
-    sorted_freqs = freq_array[sorted_indices]
-    sorted_words = [word_list[i] for i in sorted_indices]
+    train_df = get_train_data(columns=["Word", "Frequency"])
+    train_df = train_df.drop_duplicates(subset="Word")
 
-    # Sample training words
-    train_count = int(total_count * train_valid_split)
-    train_words = np.random.choice(sorted_words, train_count, p=sorted_freqs)
+    word_array = train_df["Word"].to_numpy()
+    freq_array = train_df["Frequency"].to_numpy()
 
-    # Sample validation words from low frequency words
-    valid_count = total_count - train_count
+    # Sort normalized frequencies (low to high)
+    sorted_indices = np.argsort(freq_array / freq_array.sum())
+    sorted_freqs = freq_array[sorted_indices] / freq_array.sum()
 
     # Determine the index that separates low frequency words
     lf_index = np.searchsorted(np.cumsum(sorted_freqs), frequency_threshold)
 
     # Sample validation words from low frequency candidate words
-    candidates = [
-        w for i, w in enumerate(sorted_words) if i < lf_index and w not in train_words
-    ]
+    candidates = word_array[sorted_indices[:lf_index]].tolist()
     valid_words = random.sample(candidates, min(valid_count, len(candidates)))
 
-    # Get phonemes for each word
-    train_phonemes = [g2p(word) for word in train_words]
-    valid_phonemes = [g2p(word) for word in valid_words]
-
-    # start = time.perf_counter()
-    # print(f"{time.perf_counter() - start:.2f} seconds")
-    return train_phonemes, valid_phonemes
-
-
-def create_train_data(test_data: pd.DataFrame) -> pd.DataFrame:
-    word_list = []
-    freq_list = []
-    test_words = set(test_data["Word"])
-    for i, word in enumerate(iter_wordlist("en")):
-        # Limit the number of words
-        if i >= 50000:
-            break
-        # Skip any non-alphabetic words
-        if not word.isalpha():
-            continue
-        # Skip any words in the test set
-        if word in test_words:
-            continue
-        # Skip any words that don't have vowels
-        if not any(char in "aeiouy" for char in word):
-            continue
-
-        word_list.append(word)
-        freq_list.append(word_frequency(word, "en"))
-
-    dataframe = pd.DataFrame({"Word": word_list, "Frequency": freq_list})
-    dataframe = clean_and_enrich_data(dataframe, real=True)
-
-    csv_train_path = get_dataset_dir() / "dataframe" / "complete_train.csv"
-    dataframe.to_csv(csv_train_path)
-
-    return dataframe
-    # return word_list, freq_list, total_freq
+    # Training lexicon is everything else, an exact set difference
+    train_mask = ~np.isin(word_array, valid_words)
+    train_words = word_array[train_mask]
+    train_freqs = freq_array[train_mask]
+    train_freqs = (train_freqs * train_draws / train_freqs.sum()).tolist()
 
-
-def get_train_data(force_recreate: bool = False) -> pd.DataFrame:
-    csv_train_path = get_dataset_dir() / "dataframe" / "complete_train.csv"
-    if csv_train_path.exists() and not force_recreate:
-        dataframe = pd.read_csv(csv_train_path)
-        dataframe["Phonemes"] = dataframe["Phonemes"].apply(literal_eval)
-    else:
-        test_df = get_test_data(force_recreate)
-        dataframe = create_train_data(test_df)
-    return dataframe
-
-
-def phoneme_statistics(phonemes: list):
-    # Get the counts for each phoneme
-    phoneme_stats = defaultdict(int)
-    for word in phonemes:
-        for phoneme in word:
-            phoneme_stats[phoneme] += 1
-
-    # Sort descending by count
-    phoneme_stats = dict(
-        sorted(phoneme_stats.items(), key=lambda x: x[1], reverse=True)
-    )
+    # Get phonemes for each word
+    train_phonemes = pronounce(train_words)
+    valid_phonemes = pronounce(valid_words)
+
+    return train_phonemes, train_freqs, valid_phonemes
+
+
+def phoneme_statistics(
+    phonemes: list, weights: Optional[Sequence[float]] = None
+) -> tuple[dict, dict]:
+    """
+    Phoneme and bigram counts, each word weighted by `weights` if given. With
+    the expected draw counts of `sample_words` as weights, these are expected
+    counts over one pre-sampled training set, as floats.
+    """
+    lengths = np.array([len(word) for word in phonemes], dtype=np.int64)
+    offsets = np.zeros(len(phonemes) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    # Encode against the phonemes that actually occur
+    flat = list(chain.from_iterable(phonemes))
+    index_to_phone, tokens = np.unique(np.array(flat, dtype=str), return_inverse=True)
+    vocab_size = len(index_to_phone)
+
+    # Sorted descending by count
+    unigrams = NgramCounter(vocab_size, 1).update(tokens, offsets, weights)
+    phoneme_stats = unigrams.to_dict(index_to_phone)
     phoneme_stats["<STOP>"] = 0  # Add stop token
 
-    # Get the bigram counts for each phoneme pair
-    bigram_stats = defaultdict(int)
-    for word in phonemes:
-        for i in range(len(word) - 1):
-            bigram = " ".join(word[i : i + 2])
-            bigram_stats[bigram] += 1
-
-    # trigram_stats = defaultdict(0)
-    # for sequence in phonemes:
-    #     for i in range(len(sequence) - 2):
-    #         trigram = " ".join(sequence[i:i+3])
-    #         trigram_stats[trigram] += 1
+    bigrams = NgramCounter(vocab_size, 2).update(tokens, offsets, weights)
+    bigram_stats = bigrams.to_dict(index_to_phone)
 
     return phoneme_stats, bigram_stats
 
@@ -1,5 +1,6 @@
 import pandas as pd
 
+from .models import parse_model_name
 from .paths import get_result_dir
 
 
@@ -22,7 +23,9 @@ def grid_search_log(train_losses, valid_losses, model, num_epochs):
         df = pd.DataFrame(columns=columns)
 
     # Extract parameters from the model name
-    h, l, d, t, r = [p[1:] for p in model.split("_")[1:]]
+    p = parse_model_name(model)
+    h, l, d = p["hidden_size"], p["num_layers"], p["dropout"]
+    t, r = p["tf_ratio"], p["learning_rate"]
     df.loc[model] = [model, h, l, d, t, r] + train_losses + valid_losses
     print("model", model)
 
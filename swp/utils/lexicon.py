@@ -0,0 +1,138 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from .cache import WordCache
+from .paths import get_root
+
+# Per-process annotators, built once by the pool initializers
+_g2p = None
+_nlp = None
+_morphemes = None
+
+# Coarse part of speech only needs the tagger and the tag -> POS mapping
+_SPACY_MODEL = "en_core_web_lg"
+_SPACY_EXCLUDE = ["parser", "ner", "lemmatizer", "senter"]
+
+
+def _init_g2p() -> None:
+    global _g2p
+    if _g2p is None:
+        from g2p_en import G2p
+
+        _g2p = G2p()
+
+
+def _g2p_chunk(words: list[str]) -> list[list[str]]:
+    _init_g2p()
+    return [_g2p(word) for word in words]
+
+
+def _init_morphemes() -> None:
+    global _morphemes
+    if _morphemes is None:
+        from morphemes import Morphemes
+
+        _morphemes = Morphemes(str(get_root() / "data" / "morphemes_data"))
+
+
+def _morphemes_chunk(words: list[str]) -> list[dict]:
+    _init_morphemes()
+    return [_morphemes.parse(word) for word in words]
+
+
+def _load_nlp():
+    global _nlp
+    if _nlp is None:
+        import spacy
+        import spacy.cli
+
+        if not spacy.util.is_package(_SPACY_MODEL):
+            spacy.cli.download(_SPACY_MODEL)
+        _nlp = spacy.load(_SPACY_MODEL, exclude=_SPACY_EXCLUDE)
+    return _nlp
+
+
+def _available_cpus() -> int:
+    # CPUs this process may run on, e.g. the ones a SLURM job was given
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _map_chunks(
+    func: Callable[[list], list],
+    initializer: Callable[[], None],
+    items: list,
+    num_workers: Optional[int],
+    chunk_size: int,
+) -> list:
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    num_workers = min(num_workers or _available_cpus(), len(chunks))
+
+    # Not worth spawning processes for a single chunk
+    if num_workers <= 1:
+        results = [func(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=initializer) as pool:
+            results = list(pool.map(func, chunks))
+
+    return [item for chunk in results for item in chunk]
+
+
+def _annotate(
+    words: Iterable[str], table: str, compute: Callable[[list[str]], list]
+) -> list:
+    words = list(words)
+    cache = WordCache(table)
+
+    # Only unique words missing from the cache are computed
+    unique = list(dict.fromkeys(words))
+    known = cache.get_many(unique)
+    missing = [word for word in unique if word not in known]
+
+    if missing:
+        values = compute(missing)
+        computed = dict(zip(missing, values))
+        cache.set_many(computed)
+        known.update(computed)
+
+    return [known[word] for word in words]
+
+
+def pronounce(
+    words: Iterable[str], num_workers: Optional[int] = None, chunk_size: int = 500
+) -> list[list[str]]:
+    """ARPAbet phonemes for every word, converted at most once across runs."""
+
+    def compute(missing: list[str]) -> list[list[str]]:
+        return _map_chunks(_g2p_chunk, _init_g2p, missing, num_workers, chunk_size)
+
+    return _annotate(words, "pronunciations", compute)
+
+
+def tag_parts_of_speech(
+    words: Iterable[str], n_process: int = 1, batch_size: int = 1000
+) -> list[str]:
+    """Coarse spaCy part of speech of every word, tagged at most once across runs."""
+
+    def compute(missing: list[str]) -> list[str]:
+        nlp = _load_nlp()
+        docs = nlp.pipe(missing, batch_size=batch_size, n_process=n_process)
+        return [doc[0].pos_ for doc in docs]
+
+    return _annotate(words, "parts_of_speech", compute)
+
+
+def parse_morphology(
+    words: Iterable[str], num_workers: Optional[int] = None, chunk_size: int = 200
+) -> list[dict]:
+    """MorphoLEX parse of every word, parsed at most once across runs."""
+
+    def compute(missing: list[str]) -> list[dict]:
+        return _map_chunks(
+            _morphemes_chunk, _init_morphemes, missing, num_workers, chunk_size
+        )
+
+    return _annotate(words, "morphology", compute)
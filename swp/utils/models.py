@@ -1,5 +1,11 @@
+import hashlib
+import json
+from pathlib import Path
+
 import torch
 
+from .paths import get_cornet_weights_dir
+
 
 def save_weights(filepath, embedding, encoder, decoder, epoch, checkpoint=None):
     if checkpoint:
@@ -25,3 +31,103 @@ def load_weigths(filepath, embedding, encoder, decoder, epoch, device):
     decoder.load_state_dict(
         torch.load(decoder_path, map_location=device, weights_only=True)
     )
+
+
+# Prefixed fields of a repetition model name, the loss follows unprefixed
+MODEL_FIELDS = ("e", "h", "l", "d", "t", "r", "s", "k")
+
+
+def model_name(params: dict) -> str:
+    """Weights directory name of a repetition model, see `parse_model_name`."""
+    # Schedules are stored with dashes, underscores separate the fields
+    schedule = params["tf_schedule"].replace("_", "-")
+    model = f"e{params['num_epochs']}_h{params['hidden_size']}"
+    model += f"_l{params['num_layers']}_d{params['dropout']}_t{params['tf_ratio']}"
+    model += f"_r{params['learning_rate']}_s{schedule}_k{params['tf_decay']}"
+    model += f"_{params['loss']}"
+    return model
+
+
+def parse_model_name(model: str) -> dict:
+    """
+    Hyperparameters of a repetition model name. Names from before teacher
+    forcing schedules only hold the first six fields, they were trained with
+    a constant ratio, and names without a loss were trained with cross entropy.
+    """
+    parts = model.split("_")
+    values = dict(zip(MODEL_FIELDS, [p[1:] for p in parts[: len(MODEL_FIELDS)]]))
+    return {
+        "num_epochs": int(values["e"]),
+        "hidden_size": int(values["h"]),
+        "num_layers": int(values["l"]),
+        "dropout": float(values["d"]),
+        "tf_ratio": float(values["t"]),
+        "learning_rate": float(values["r"]),
+        "tf_schedule": values.get("s", "constant").replace("-", "_"),
+        "tf_decay": float(values.get("k", 1.0)),
+        "loss": parts[len(MODEL_FIELDS)] if len(parts) > len(MODEL_FIELDS) else "ce",
+    }
+
+
+CORNET_URL = "https://s3.amazonaws.com/cornet-models"
+
+
+def cornet_filename(model_letter: str, model_hash: str) -> str:
+    return f"cornet_{model_letter.lower()}-{model_hash}.pth"
+
+
+def verify_checkpoint(path: Path, model_hash: str) -> None:
+    """
+    Checks that the sha256 of `path` starts with `model_hash`, the torch hub
+    convention the CORnet file names follow. A successful check is recorded
+    next to the file with its size and mtime, so it only reruns when the
+    file changes.
+    """
+    stat = path.stat()
+    record = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": model_hash}
+    record_path = path.with_suffix(".verified")
+    if record_path.exists():
+        with record_path.open("r") as f:
+            if json.load(f) == record:
+                return
+
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    if not digest.hexdigest().startswith(model_hash):
+        raise RuntimeError(
+            f"Checksum mismatch for {path}: expected a sha256 starting with "
+            f"{model_hash}, got {digest.hexdigest()}. The file is corrupt or "
+            "belongs to another model."
+        )
+
+    with record_path.open("w") as f:
+        json.dump(record, f)
+
+
+def load_cornet_state_dict(model_letter: str, model_hash: str, map_location=None):
+    """
+    Loads pretrained CORnet weights from the local registry under
+    get_weights_dir() / "cornet". Never downloads: missing files raise with
+    the path and URL to fetch them from on a machine with internet access.
+    """
+    filename = cornet_filename(model_letter, model_hash)
+    path = get_cornet_weights_dir() / filename
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Pretrained CORnet-{model_letter.upper()} weights not found at {path}. "
+            f"Download {CORNET_URL}/{filename} and copy it there."
+        )
+    verify_checkpoint(path, model_hash)
+
+    # Tensors stay on disk until used, legacy pickles cannot be mapped
+    try:
+        ckpt_data = torch.load(
+            path, map_location=map_location, mmap=True, weights_only=True
+        )
+    except RuntimeError:
+        ckpt_data = torch.load(path, map_location=map_location, weights_only=True)
+
+    state_dict = ckpt_data["state_dict"]
+    return {k.removeprefix("module."): v for (k, v) in state_dict.items()}
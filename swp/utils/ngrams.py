@@ -0,0 +1,116 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def ngram_keys(
+    tokens: np.ndarray,
+    offsets: np.ndarray,
+    order: int,
+    base: int,
+    positional: bool = False,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Packs every n-gram of an encoded corpus into one int64 key, with the
+    tokens as base `base` digits (and the start position as the most
+    significant digit if positional). Returns the keys and their word ids.
+    N-grams never cross word boundaries.
+    """
+    tokens = np.asarray(tokens, dtype=np.int64)
+    offsets = np.asarray(offsets, dtype=np.int64) - offsets[0]
+    lengths = np.diff(offsets)
+
+    word_ids = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(len(tokens)) - offsets[:-1][word_ids]
+    starts = np.flatnonzero(positions + order <= lengths[word_ids])
+
+    keys = np.zeros(len(starts), dtype=np.int64)
+    for k in range(order):
+        keys = keys * base + tokens[starts + k]
+    if positional:
+        keys += positions[starts] * base**order
+
+    return keys, word_ids[starts]
+
+
+class NgramCounter:
+    """
+    Counts n-grams of a fixed order over encoded corpora (flat tokens plus
+    word offsets). Counts accumulate across `update` calls, so statistics can
+    follow a growing corpus without recounting it.
+    """
+
+    def __init__(
+        self, vocab_size: int, order: int, positional: bool = False
+    ) -> None:
+        self.base = vocab_size
+        self.order = order
+        self.positional = positional
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.float64)
+
+    def update(
+        self,
+        tokens: np.ndarray,
+        offsets: np.ndarray,
+        weights: Optional[Sequence[float]] = None,
+        chunk_words: int = 100000,
+    ) -> "NgramCounter":
+        # Count in chunks of words to bound the size of the key arrays
+        keys, counts = [self.keys], [self.counts]
+        for start in range(0, len(offsets) - 1, chunk_words):
+            end = min(start + chunk_words, len(offsets) - 1)
+            chunk_tokens = tokens[offsets[start] : offsets[end]]
+            chunk_keys, word_ids = ngram_keys(
+                chunk_tokens,
+                offsets[start : end + 1],
+                self.order,
+                self.base,
+                self.positional,
+            )
+            # Each n-gram counts as much as the word it comes from
+            if weights is None:
+                chunk_weights = None
+            else:
+                chunk_weights = np.asarray(weights[start:end], np.float64)[word_ids]
+            uniques, inverse = np.unique(chunk_keys, return_inverse=True)
+            keys.append(uniques)
+            counts.append(np.bincount(inverse, weights=chunk_weights))
+
+        self.keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate(counts))
+        return self
+
+    def decode(self, keys: Optional[np.ndarray] = None) -> tuple[np.ndarray, ...]:
+        """Unpacks keys into a (len, order) array of indices and positions."""
+        keys = self.keys if keys is None else keys
+        ngrams = np.empty((len(keys), self.order), dtype=np.int64)
+        rest = keys.copy()
+        for k in reversed(range(self.order)):
+            rest, ngrams[:, k] = np.divmod(rest, self.base)
+        return ngrams, rest
+
+    def to_dict(self, index_to_phone: Sequence[str]) -> dict:
+        """
+        Space-joined n-grams mapped to their counts, sorted by decreasing
+        count and then by n-gram, so ties always come out in the same order.
+        Positional counters map each start position to such a dict.
+        """
+        phones = np.asarray(index_to_phone, dtype=object)
+        ngrams, positions = self.decode()
+        names = np.array([" ".join(p) for p in phones[ngrams].tolist()], dtype=str)
+        order = np.lexsort((names, -self.counts))
+        counts = self.counts
+        if np.all(counts == np.round(counts)):
+            counts = counts.astype(np.int64)
+
+        names = names[order].tolist()
+        if not self.positional:
+            return dict(zip(names, counts[order].tolist()))
+
+        stats: dict[int, dict] = {}
+        for name, position, count in zip(
+            names, positions[order].tolist(), counts[order].tolist()
+        ):
+            stats.setdefault(position, {})[name] = count
+        return dict(sorted(stats.items()))
@@ -37,6 +37,18 @@ def get_dataframe_dir() -> pathlib.Path:
     return dataframe_dir
 
 
+def get_phonemes_dir() -> pathlib.Path:
+    phonemes_dir = dataset_dir / "phonemes"
+    phonemes_dir.mkdir(parents=True, exist_ok=True)
+    return phonemes_dir
+
+
+def get_features_dir() -> pathlib.Path:
+    features_dir = dataset_dir / "features"
+    features_dir.mkdir(parents=True, exist_ok=True)
+    return features_dir
+
+
 def get_folds_dir() -> pathlib.Path:
     folds_dir = dataset_dir / "folds"
     folds_dir.mkdir(parents=True, exist_ok=True)
@@ -48,6 +60,12 @@ def get_weights_dir() -> pathlib.Path:
     return weights_dir
 
 
+def get_cornet_weights_dir() -> pathlib.Path:
+    cornet_dir = get_weights_dir() / "cornet"
+    cornet_dir.mkdir(parents=True, exist_ok=True)
+    return cornet_dir
+
+
 def get_result_dir() -> pathlib.Path:
     result_dir.mkdir(parents=True, exist_ok=True)
     return result_dir